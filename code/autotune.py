@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import yaml
+
+DEFAULT_BATCH_SIZES = (8, 16, 32)
+DEFAULT_WORKERS = (0, 2, 4, 8)
+
+# ==========================
+# === Throughput Trials ====
+# ==========================
+
+def _total_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _thread_candidates():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return tuple(sorted({max(1, cores // 4), max(1, cores // 2), cores}))
+
+
+def _trial(weights, data, imgsz, batch, workers, threads, iterations, warmup, enhance):
+    """
+    Run a few SGD steps of the real model and dataloader in a fresh process.
+
+    Returns:
+        (images/sec, peak RSS in bytes of this process plus its live dataloader workers)
+    """
+    import psutil
+    import torch
+    from ultralytics import YOLO
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_dataloader
+    from ultralytics.data.utils import check_det_dataset
+
+    from training_data import CachedYOLODataset, PreprocessingYOLODataset, build_preprocessing_dataset
+
+    torch.set_num_threads(threads)
+    cfg = get_cfg(overrides={"data": data, "imgsz": imgsz, "batch": batch, "workers": workers, "device": "cpu"})
+    data_dict = check_det_dataset(data)
+
+    net = YOLO(weights).model
+    net.args = cfg
+    net.train()
+    for p in net.parameters():
+        p.requires_grad = True
+    gs = max(int(net.stride.max()), 32)
+
+    dataset = build_preprocessing_dataset(
+        cfg, data_dict["train"], batch, data_dict, mode="train", stride=gs,
+        dataset_cls=PreprocessingYOLODataset if enhance else CachedYOLODataset,
+    )
+    loader = build_dataloader(dataset, batch, workers, shuffle=True)
+    if len(loader) == 0:
+        raise ValueError(f"No training images in {data}")
+    optimizer = torch.optim.SGD(net.parameters(), lr=1e-4, momentum=0.9)
+
+    # Workers are alive for the whole trial, so RUSAGE_CHILDREN (exited children only)
+    # can't see them; sample their current RSS after every step and keep the peak.
+    this_process = psutil.Process()
+
+    def workers_rss():
+        total = 0
+        for child in this_process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    done, start, workers_peak = 0, None, 0
+    while done < warmup + iterations:
+        for batch_data in loader:
+            if done == warmup:
+                start = time.perf_counter()
+            batch_data["img"] = batch_data["img"].float() / 255
+            loss, _ = net(batch_data)
+            optimizer.zero_grad()
+            loss.sum().backward()
+            optimizer.step()
+            workers_peak = max(workers_peak, workers_rss())
+            done += 1
+            if done >= warmup + iterations:
+                break
+    elapsed = time.perf_counter() - start
+
+    return batch * iterations / elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 + workers_peak
+
+
+def run_trial(weights, data, imgsz, batch, workers, threads, iterations=10, warmup=3, enhance=False):
+    """Run _trial in a spawned process so threads, workers and memory don't leak between trials."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_trial, weights, data, imgsz, batch, workers, threads, iterations, warmup, enhance).result()
+
+
+def autotune(weights, data, imgsz=640, batch_sizes=DEFAULT_BATCH_SIZES, workers=DEFAULT_WORKERS, threads=None,
+             iterations=10, warmup=3, enhance=False, memory_fraction=0.8):
+    """
+    Pick the batch size, dataloader workers and torch threads with the highest training throughput.
+
+    Coordinate search: torch threads first (middle batch size, 2 workers), then workers
+    with the best thread count, then batch size. A setting is rejected when its trial
+    fails (e.g. out of memory) or its peak memory exceeds memory_fraction of the RAM.
+
+    Returns:
+        Dict with batch, workers, threads and images_per_sec
+    """
+    threads = threads or _thread_candidates()
+    budget = memory_fraction * _total_memory()
+    best = {"batch": batch_sizes[len(batch_sizes) // 2], "workers": min(workers, key=lambda w: abs(w - 2)),
+            "threads": threads[-1], "images_per_sec": 0.0}
+    tried = {}
+
+    def measure(setting):
+        key = (setting["batch"], setting["workers"], setting["threads"])
+        if key not in tried:
+            try:
+                speed, peak = run_trial(weights, data, imgsz, *key, iterations=iterations, warmup=warmup,
+                                        enhance=enhance)
+                fits = peak <= budget
+                print(f"  batch={key[0]:<3d} workers={key[1]:<2d} threads={key[2]:<3d} {speed:8.2f} images/sec  "
+                      f"peak {peak / 1024 ** 3:.2f} GiB{'' if fits else ' (over memory budget)'}")
+                tried[key] = speed if fits else None
+            except (RuntimeError, MemoryError, ValueError, BrokenProcessPool) as e:
+                print(f"  batch={key[0]:<3d} workers={key[1]:<2d} threads={key[2]:<3d} failed: {type(e).__name__}: {e}")
+                tried[key] = None
+        return tried[key]
+
+    for name, candidates in (("threads", threads), ("workers", workers), ("batch", batch_sizes)):
+        for value in candidates:
+            setting = dict(best, **{name: value})
+            speed = measure(setting)
+            if speed is not None and speed > best["images_per_sec"]:
+                best = dict(setting, images_per_sec=speed)
+
+    print(f"Best: batch={best['batch']} workers={best['workers']} threads={best['threads']} "
+          f"({best['images_per_sec']:.2f} images/sec)")
+    return best
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Probe batch size, dataloader workers and torch threads for CPU training")
+    parser.add_argument("--model", default="yolov8n.pt")
+    parser.add_argument("--data", default=os.path.join(BASE_DIR, "data", "yolo_dataset", "dataset.yaml"))
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch", type=int, nargs="+", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--workers", type=int, nargs="+", default=list(DEFAULT_WORKERS))
+    parser.add_argument("--threads", type=int, nargs="+")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed steps per trial")
+    parser.add_argument("--enhanced", action="store_true", help="Measure with on-the-fly enhancement")
+    parser.add_argument("--out", help="Write the chosen settings to this YAML (usable as train.py --config)")
+    args = parser.parse_args()
+
+    result = autotune(args.model, args.data, args.imgsz, tuple(args.batch), tuple(args.workers),
+                      tuple(args.threads) if args.threads else None, args.iterations, enhance=args.enhanced)
+    if args.out:
+        with open(args.out, "w") as f:
+            yaml.safe_dump({k: result[k] for k in ("batch", "workers", "threads")}, f, sort_keys=False)
+        print(f"Saved to {args.out}")
+    sys.exit(0 if result["images_per_sec"] > 0 else 1)
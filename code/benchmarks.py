@@ -0,0 +1,423 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from image_preproccesing_functions import (
+    IMAGE_EXTENSIONS,
+    run_enhance_tasks,
+    Image_rescaling,
+    Image_contrased_enhancemend,
+    Image_convertion_Lab,
+    Image_convertion_HSV,
+    remove_noise,
+    run_pipeline,
+    PreprocessingEngine,
+)
+from format_yolo_folders import write_yolo_labels
+
+
+# ===============================
+# === Worker Scaling Benchmark ==
+# ===============================
+
+def benchmark_workers(image_dir, max_workers=None, limit=64, chunksize=8):
+    """
+    Measure dataset enhancement throughput for 1..max_workers processes.
+
+    Args:
+        image_dir: Directory searched recursively for sample images
+        max_workers: Highest worker count to try (default: all cores)
+        limit: Number of images enhanced per measurement
+        chunksize: Tasks handed to a worker at a time
+
+    Returns:
+        Dict mapping worker count to images/sec
+    """
+    files = sorted(
+        f for f in glob.glob(os.path.join(image_dir, "**", "*.*"), recursive=True)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not files:
+        print(f"No images found under {image_dir}")
+        return {}
+
+    max_workers = max_workers or os.cpu_count() or 1
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        tasks = [(f, os.path.join(out_dir, f"{i}_{os.path.basename(f)}")) for i, f in enumerate(files)]
+        for workers in range(1, max_workers + 1):
+            start = time.perf_counter()
+            processed, errors = run_enhance_tasks(tasks, workers, chunksize, progress_every=0)
+            elapsed = time.perf_counter() - start
+            results[workers] = processed / elapsed if elapsed > 0 else 0.0
+            print(f"  workers={workers:<3d} {results[workers]:8.2f} images/sec "
+                  f"({processed} ok, {len(errors)} failed, {elapsed:.2f}s)")
+
+    return results
+
+
+# ============================
+# === Label Writer Benchmark ==
+# ============================
+
+def _write_labels_iterrows(df, class_mapping, label_dir):
+    """Reference per-row writer, kept to compare against write_yolo_labels."""
+    for filename, group in df.groupby('filename'):
+        with open(Path(label_dir) / f"{filename}.txt", 'w') as f:
+            for _, row in group.iterrows():
+                class_id = class_mapping[row['class']]
+                width = row['width']
+                height = row['height']
+                x_center = ((row['xmin'] + row['xmax']) / 2) / width
+                y_center = ((row['ymin'] + row['ymax']) / 2) / height
+                bbox_width = (row['xmax'] - row['xmin']) / width
+                bbox_height = (row['ymax'] - row['ymin']) / height
+                f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
+
+
+def benchmark_labels(csv_file, repeat=10, write_workers=4):
+    """
+    Compare annotations/sec of the per-row label writer and write_yolo_labels.
+
+    The CSV is tiled `repeat` times (with renamed files) to get a larger workload,
+    and the outputs of both writers are checked to be identical.
+
+    Returns:
+        Dict mapping writer name to annotations/sec
+    """
+    base = pd.read_csv(csv_file)
+    df = pd.concat(
+        [base.assign(filename=base['filename'].astype(str) + f"_r{i}") for i in range(repeat)],
+        ignore_index=True,
+    )
+    class_mapping = {cls: idx for idx, cls in enumerate(sorted(df['class'].unique()))}
+
+    writers = {
+        'iterrows': lambda out: _write_labels_iterrows(df, class_mapping, out),
+        'vectorised': lambda out: write_yolo_labels(df, class_mapping, out),
+        f'vectorised+{write_workers}threads': lambda out: write_yolo_labels(df, class_mapping, out, write_workers),
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = {}
+        for name, writer in writers.items():
+            out = Path(tmp) / name
+            out.mkdir()
+            start = time.perf_counter()
+            writer(out)
+            elapsed = time.perf_counter() - start
+            results[name] = len(df) / elapsed if elapsed > 0 else 0.0
+            outputs[name] = {p.name: p.read_text() for p in out.iterdir()}
+            print(f"  {name:<24s} {results[name]:12.0f} annotations/sec ({len(df)} annotations, {elapsed:.3f}s)")
+
+        reference = outputs['iterrows']
+        for name, files in outputs.items():
+            if files != reference:
+                print(f"  Warning: {name} output differs from the per-row writer")
+
+    return results
+
+
+# ================================
+# === Preprocessing Stage Suite ==
+# ================================
+
+# name -> (function, keyword arguments); every stage takes a BGR uint8 image
+STAGE_BENCHMARKS = {
+    "clahe": (Image_contrased_enhancemend, {}),
+    "denoise_gaussian": (remove_noise, {"method": "gaussian"}),
+    "denoise_median": (remove_noise, {"method": "median"}),
+    "denoise_bilateral": (remove_noise, {"method": "bilateral"}),
+    "denoise_fastNlMeans": (remove_noise, {"method": "fastNlMeans"}),
+    "lab": (Image_convertion_Lab, {}),
+    "hsv": (Image_convertion_HSV, {}),
+    "rescale": (Image_rescaling, {}),
+    # The same stages on a reused PreprocessingEngine (steady state: no frame-sized allocations)
+    "clahe_engine": (PreprocessingEngine().enhance, {}),
+    "denoise_bilateral_engine": (PreprocessingEngine().denoise, {}),
+    "rescale_engine_f32": (PreprocessingEngine().rescale, {}),
+    "rescale_engine_f16": (PreprocessingEngine(float_dtype=np.float16).rescale, {}),
+}
+DEFAULT_SIZES = (640, 1280, 3000)
+
+
+def synthetic_board(size, seed=0):
+    """
+    Deterministic PCB-like test image with its long side = size (4:3).
+
+    Green solder mask with traces, pads, silkscreen-like text and sensor noise, so
+    the filters see edges and texture rather than a flat frame.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = int(size * 3 / 4), size
+    img = np.empty((h, w, 3), dtype=np.uint8)
+    img[:] = (40, 110, 30)
+    scale = max(1, size // 640)
+    for _ in range(60 * scale):
+        p1 = tuple(int(v) for v in rng.integers(0, (w, h)))
+        p2 = (p1[0], int(rng.integers(0, h))) if rng.random() < 0.5 else (int(rng.integers(0, w)), p1[1])
+        cv2.line(img, p1, p2, (60, 170, 190), int(rng.integers(1, 4)) * scale)
+    for _ in range(150 * scale):
+        center = tuple(int(v) for v in rng.integers(0, (w, h)))
+        cv2.circle(img, center, int(rng.integers(3, 10)) * scale, (170, 180, 190), -1)
+    for _ in range(20 * scale):
+        origin = tuple(int(v) for v in rng.integers(0, (w, h)))
+        cv2.putText(img, f"R{int(rng.integers(1, 999))}", origin, cv2.FONT_HERSHEY_SIMPLEX, 0.5 * scale,
+                    (235, 235, 235), scale)
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def resize_long_side(img, size):
+    h, w = img.shape[:2]
+    r = size / max(h, w)
+    if r == 1:
+        return img
+    interpolation = cv2.INTER_AREA if r < 1 else cv2.INTER_LINEAR
+    return cv2.resize(img, (max(1, round(w * r)), max(1, round(h * r))), interpolation=interpolation)
+
+
+def load_sample_images(image_dir, limit=4):
+    files = sorted(
+        f for f in glob.glob(os.path.join(image_dir, "**", "*.*"), recursive=True)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    images = [cv2.imread(f) for f in files]
+    return [im for im in images if im is not None]
+
+
+def measure_stage(func, kwargs, images, repeat=5, max_seconds=10.0):
+    """
+    Time one stage over a list of same-resolution images.
+
+    Each image is run once as warm-up, then up to `repeat` timed rounds are made
+    (fewer if `max_seconds` is used up, always at least one). Peak memory is measured
+    in a separate untimed pass with tracemalloc, which sees every NumPy array the
+    stage allocates (outputs and Python-level temporaries, not OpenCV's internal buffers).
+
+    Returns:
+        Dict with median/p90/min latency (ms), images/sec, megapixels/sec and peak MiB
+    """
+    for img in images:
+        func(img, **kwargs)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for img in images:
+            t0 = time.perf_counter()
+            func(img, **kwargs)
+            latencies.append(time.perf_counter() - t0)
+        if time.perf_counter() - started > max_seconds:
+            break
+
+    tracemalloc.start()
+    for img in images:
+        tracemalloc.reset_peak()
+        func(img, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    megapixels = images[0].shape[0] * images[0].shape[1] / 1e6
+    median = float(np.median(latencies))
+    return {
+        "shape": list(images[0].shape),
+        "runs": len(latencies),
+        "median_ms": median * 1000,
+        "p90_ms": float(np.percentile(latencies, 90)) * 1000,
+        "min_ms": float(latencies.min()) * 1000,
+        "images_per_sec": 1.0 / median if median > 0 else 0.0,
+        "mpix_per_sec": megapixels / median if median > 0 else 0.0,
+        "peak_mib": peak / 1024 ** 2,
+    }
+
+
+def benchmark_stages(sizes=DEFAULT_SIZES, stages=None, image_dir=None, repeat=5, max_seconds=10.0):
+    """
+    Per-stage latency, throughput and peak memory on synthetic boards and (optionally) sample images.
+
+    Returns:
+        Dict with "meta" (versions, threads, CPU) and "results" keyed "<stage>@<input>_<size>"
+    """
+    stages = stages or list(STAGE_BENCHMARKS)
+    inputs = {}
+    for size in sizes:
+        inputs[f"synthetic_{size}"] = [synthetic_board(size)]
+    if image_dir:
+        samples = load_sample_images(image_dir)
+        if not samples:
+            print(f"No sample images found under {image_dir}")
+        for size in sizes:
+            resized = [resize_long_side(im, size) for im in samples]
+            # Stages are timed per resolution, so only keep samples of the first sample's shape
+            resized = [im for im in resized if im.shape == resized[0].shape] if resized else []
+            if resized:
+                inputs[f"sample_{size}"] = resized
+
+    results = {}
+    for input_name, images in inputs.items():
+        for stage in stages:
+            func, kwargs = STAGE_BENCHMARKS[stage]
+            key = f"{stage}@{input_name}"
+            results[key] = measure_stage(func, kwargs, images, repeat, max_seconds)
+            r = results[key]
+            print(f"  {key:<36s} {r['median_ms']:10.2f} ms  (p90 {r['p90_ms']:9.2f})  "
+                  f"{r['mpix_per_sec']:8.2f} MPix/s  peak {r['peak_mib']:8.1f} MiB  [{r['runs']} runs]")
+
+    meta = {
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return {"meta": meta, "results": results}
+
+
+def check_regressions(current, baseline, threshold=0.2, metric="median_ms"):
+    """
+    Compare a benchmark_stages result against a stored baseline.
+
+    Returns:
+        List of (key, baseline value, current value, relative change) for every entry
+        whose `metric` grew by more than `threshold` (0.2 = 20% slower)
+    """
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        now = current["results"].get(key)
+        if now is None or base.get(metric, 0) <= 0:
+            continue
+        change = now[metric] / base[metric] - 1
+        if change > threshold:
+            regressions.append((key, base[metric], now[metric], change))
+    return regressions
+
+
+# ===================================
+# === Tile-parallel Latency Check ===
+# ===================================
+
+def benchmark_tiles(img, max_workers=None, method="bilateral", outputs=("enhanced", "lab", "hsv"), repeat=3):
+    """
+    Single-image pipeline latency with 1..max_workers tile threads (run_pipeline tile_workers).
+
+    Every tiled result is compared against the whole-frame one; any difference is reported,
+    since the tiled mode must produce identical images.
+
+    Returns:
+        Dict mapping tile workers to median latency in ms
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    stage_kwargs = {"denoised": {"method": method}}
+    reference = run_pipeline(img, outputs, stage_kwargs)
+    counts = sorted({1, max_workers, *(2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i < max_workers)})
+
+    results = {}
+    for workers in counts:
+        run_pipeline(img, outputs, stage_kwargs, tile_workers=workers)  # warm-up, starts the pool
+        latencies = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = run_pipeline(img, outputs, stage_kwargs, tile_workers=workers)
+            latencies.append(time.perf_counter() - t0)
+        results[workers] = float(np.median(latencies)) * 1000
+        different = [name for name in outputs if not np.array_equal(result[name], reference[name])]
+        print(f"  tile_workers={workers:<3d} {results[workers]:10.2f} ms  speed-up {results[1] / results[workers]:5.2f}x"
+              f"{'  MISMATCH: ' + ', '.join(different) if different else ''}")
+    return results
+
+
+def run_stage_suite(argv):
+    parser = argparse.ArgumentParser(prog="benchmarks.py stages", description="Preprocessing stage benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Long-side resolutions")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGE_BENCHMARKS))
+    parser.add_argument("--images", help="Directory of sample boards to benchmark besides the synthetic ones")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="Time budget per stage and input")
+    parser.add_argument("--threads", type=int, help="cv2.setNumThreads before measuring")
+    parser.add_argument("--out", help="Write the results JSON here")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs the baseline (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite --baseline with these results")
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    report = benchmark_stages(args.sizes, args.stages, args.images, args.repeat, args.max_seconds)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.out}")
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    regressions = check_regressions(report, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}:")
+        for key, before, after, change in regressions:
+            print(f"  {key:<36s} {before:10.2f} ms -> {after:10.2f} ms  (+{change:.0%})")
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "stages":
+        sys.exit(run_stage_suite(sys.argv[2:]))
+
+    if len(sys.argv) < 3:
+        print("Usage: python benchmarks.py workers <image_dir> [max_workers] [limit]")
+        print("       python benchmarks.py labels <annotations_csv> [repeat]")
+        print("       python benchmarks.py stages [--sizes ...] [--images DIR] [--baseline FILE] [--out FILE]")
+        print("       python benchmarks.py tiles <image | long side of a synthetic board> [max_workers] [denoise method]")
+        sys.exit(1)
+
+    mode = sys.argv[1]
+    if mode == "workers":
+        benchmark_workers(
+            sys.argv[2],
+            max_workers=int(sys.argv[3]) if len(sys.argv) > 3 else None,
+            limit=int(sys.argv[4]) if len(sys.argv) > 4 else 64,
+        )
+    elif mode == "labels":
+        benchmark_labels(sys.argv[2], repeat=int(sys.argv[3]) if len(sys.argv) > 3 else 10)
+    elif mode == "tiles":
+        img = synthetic_board(int(sys.argv[2])) if sys.argv[2].isdigit() else cv2.imread(sys.argv[2])
+        if img is None:
+            print(f"Could not read {sys.argv[2]}")
+            sys.exit(1)
+        benchmark_tiles(
+            img,
+            max_workers=int(sys.argv[3]) if len(sys.argv) > 3 else None,
+            method=sys.argv[4] if len(sys.argv) > 4 else "bilateral",
+        )
+    else:
+        print(f"Unknown mode: {mode}")
+        sys.exit(1)
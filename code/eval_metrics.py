@@ -1,17 +1,49 @@
 import os
+import sys
 import json
 import shutil
 import pandas as pd
+import yaml
 
-def training_curves(OUTPUTS_DIR,model_name):
-    src_curves = os.path.join(OUTPUTS_DIR, model_name, "results.png")
-    dst_curves = os.path.join(OUTPUTS_DIR, f"{model_name}_training_curves.png")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from instrumentation import timed, count
+
+METRIC_COLUMNS = {
+    "precision": "metrics/precision(B)",
+    "recall": "metrics/recall(B)",
+    "map50": "metrics/mAP50(B)",
+    "map50_95": "metrics/mAP50-95(B)",
+}
+RUN_ARGS = ("model", "data", "epochs", "imgsz", "batch", "optimizer", "lr0", "seed")
+STORE_NAME = "runs.json"
+SUMMARY_NAME = "runs_summary.csv"
+
+def run_id_for(root, run_dir):
+    """Run id of a run directory under one of the search roots: "<root name>/<path below root>"."""
+    rel = os.path.relpath(run_dir, root).replace(os.sep, "/")
+    return f"{os.path.basename(os.path.normpath(root))}/{rel}"
+
+
+def artifact_name(run_id):
+    """
+    File-name stem for everything exported for a run: the run id with "/" as "__".
+
+    Run names alone repeat across roots and sweeps, so the JSON and the copied plots
+    are all named after the full id, e.g. results_outputs__baseline.json and
+    outputs__baseline_training_curves.png.
+    """
+    return run_id.replace("/", "__")
+
+
+def training_curves(run_dir, run_id):
+    src_curves = os.path.join(run_dir, "results.png")
+    dst_curves = os.path.join(os.path.dirname(run_dir), f"{artifact_name(run_id)}_training_curves.png")
     if os.path.exists(src_curves):
         shutil.copy(src_curves, dst_curves)
 
-def confusion_matrix(OUTPUTS_DIR,model_name):
-    src_confmat = os.path.join(OUTPUTS_DIR,model_name, "confusion_matrix.png")
-    dst_confmat = os.path.join(OUTPUTS_DIR, "confusion_matrix.png")
+def confusion_matrix(run_dir, run_id):
+    src_confmat = os.path.join(run_dir, "confusion_matrix.png")
+    dst_confmat = os.path.join(os.path.dirname(run_dir), f"{artifact_name(run_id)}_confusion_matrix.png")
     if os.path.exists(src_confmat):
         shutil.copy(src_confmat, dst_confmat)
 
@@ -25,48 +57,224 @@ def sample_predictions(OUTPUTS_DIR):
         if "batch" in file.lower() and file.lower().endswith((".jpg")):
             src = os.path.join(MODEL_DIR, file)
             dst = os.path.join(SAMPLE_PRED_DIR, f"pred_{file}")
-            shutil.move(src, dst)
-            copied += 1
+            # Copy, not move: the run directory stays complete for Ultralytics and later re-exports
+            if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+                shutil.copy2(src, dst)
+                copied += 1
 
     if copied == 0:
-        print("No prediction images found in outputs directory.")
+        print("No new prediction images found in outputs directory.")
     else:
         print(f"Copied {copied} sample prediction(s) to '{SAMPLE_PRED_DIR}'")
 
-def save_metrics_to_json(OUTPUTS_DIR,METRICS_DIR,model_name):
-    csv_path = os.path.join(OUTPUTS_DIR,"results.csv")
-    df = pd.read_csv(csv_path)
-    last_row = df.iloc[-1]
-    precision = float(last_row.get("metrics/precision(B)", 0))
-    recall = float(last_row.get("metrics/recall(B)", 0))
-    f1 = 2 * (precision * recall) / (precision + recall )
-    map50 = float(last_row.get("metrics/mAP50(B)", 0))
-    metrics_data = {
-        "precision": precision,
-        "recall": recall,
-        "f1": f1,
-        "map50": map50
-    }
-
-    json_path = os.path.join(METRICS_DIR, f"results_{model_name}.json")
+
+def f1_score(precision, recall):
+    return 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0.0
+
+
+def write_metrics_json(METRICS_DIR, run_id, last):
+    json_path = os.path.join(METRICS_DIR, f"results_{artifact_name(run_id)}.json")
     with open(json_path, "w") as f:
-        json.dump(metrics_data, f, indent=4)
+        json.dump({k: last[k] for k in ("precision", "recall", "f1", "map50")}, f, indent=4)
+
+
+def save_metrics_to_json(run_dir, METRICS_DIR, run_id):
+    csv_path = os.path.join(run_dir, "results.csv")
+    write_metrics_json(METRICS_DIR, run_id, summarize_results(csv_path)["last"])
 
 
 def export_results(OUTPUTS_DIR, METRICS_DIR,model_name):
-    os.makedirs(os.path.join(OUTPUTS_DIR,model_name), exist_ok=True)
-    os.makedirs(os.path.join(METRICS_DIR), exist_ok=True)
-    OUTPUTS_DIR = os.path.join(OUTPUTS_DIR,model_name)
-    training_curves(OUTPUTS_DIR,model_name)
-    confusion_matrix(OUTPUTS_DIR,model_name)
-    sample_predictions(OUTPUTS_DIR)
-    save_metrics_to_json(OUTPUTS_DIR,METRICS_DIR,model_name)
+    run_dir = os.path.join(OUTPUTS_DIR, model_name)
+    os.makedirs(run_dir, exist_ok=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    run_id = run_id_for(OUTPUTS_DIR, run_dir)
+    training_curves(run_dir, run_id)
+    confusion_matrix(run_dir, run_id)
+    sample_predictions(run_dir)
+    save_metrics_to_json(run_dir, METRICS_DIR, run_id)
+
+# =====================
+# === Run Collector ===
+# =====================
+
+def _epoch_metrics(row):
+    metrics = {"epoch": int(row["epoch"])}
+    for key, column in METRIC_COLUMNS.items():
+        value = row.get(column, 0.0)
+        metrics[key] = 0.0 if pd.isna(value) else float(value)
+    metrics["f1"] = f1_score(metrics["precision"], metrics["recall"])
+    return metrics
+
+
+@timed("eval.summarize_results")
+def summarize_results(csv_path):
+    """
+    Read one Ultralytics results.csv and pick out the last and the best epoch.
+
+    The best epoch uses the Ultralytics fitness (0.1 * mAP50 + 0.9 * mAP50-95), i.e.
+    the epoch that best.pt was saved from.
+
+    Returns:
+        Dict with "epochs", "last" and "best" (each a dict of epoch metrics)
+    """
+    df = pd.read_csv(csv_path)
+    df.columns = df.columns.str.strip()  # older Ultralytics versions pad the header
+    if df.empty:
+        raise ValueError(f"No epochs in {csv_path}")
+    fitness = 0.1 * df.get(METRIC_COLUMNS["map50"], 0.0) + 0.9 * df.get(METRIC_COLUMNS["map50_95"], 0.0)
+    best_row = df.loc[pd.Series(fitness, index=df.index).fillna(0.0).idxmax()]
+    return {"epochs": len(df), "last": _epoch_metrics(df.iloc[-1]), "best": _epoch_metrics(best_row)}
+
+
+def discover_runs(roots):
+    """
+    Find run directories (anything holding a results.csv or args.yaml) under the given roots.
+
+    Returns:
+        Dict run id ("<root name>/<run name>") -> run directory
+    """
+    runs = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d not in ("weights", "sample_predictions"))
+            if "results.csv" in filenames or "args.yaml" in filenames:
+                runs[run_id_for(root, dirpath)] = dirpath
+    return runs
+
+
+def run_signature(run_dir):
+    """(mtime_ns, size) of results.csv and args.yaml; a run is re-read only when this changes."""
+    signature = []
+    for name in ("results.csv", "args.yaml"):
+        try:
+            st = os.stat(os.path.join(run_dir, name))
+            signature.append([st.st_mtime_ns, st.st_size])
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+
+def ingest_run(run_id, run_dir):
+    """Build the store record for one run directory."""
+    record = {"run": run_id, "path": run_dir, "signature": run_signature(run_dir), "status": "config_only"}
+
+    args_path = os.path.join(run_dir, "args.yaml")
+    if os.path.exists(args_path):
+        with open(args_path, "r") as f:
+            args = yaml.safe_load(f) or {}
+        record["args"] = {key: args.get(key) for key in RUN_ARGS if key in args}
+
+    csv_path = os.path.join(run_dir, "results.csv")
+    if os.path.exists(csv_path):
+        try:
+            record.update(summarize_results(csv_path))
+            planned = record.get("args", {}).get("epochs") or 0
+            record["status"] = "complete" if record["epochs"] >= planned else "partial"
+        except (ValueError, KeyError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+    return record
+
+
+def load_store(store_path):
+    if not os.path.exists(store_path):
+        return {}
+    with open(store_path, "r") as f:
+        return json.load(f).get("runs", {})
+
+
+def save_store(store_path, runs):
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": 1, "runs": runs}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, store_path)
+
+
+def summary_table(runs):
+    """Flatten store records into one comparison row per run, best mAP50-95 first."""
+    rows = []
+    for record in runs.values():
+        row = {"run": record["run"], "status": record["status"], "epochs": record.get("epochs", 0)}
+        row.update({f"arg_{k}": v for k, v in record.get("args", {}).items()})
+        for which in ("best", "last"):
+            for key, value in record.get(which, {}).items():
+                row[f"{which}_{key}"] = value
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if "best_map50_95" in df.columns:
+        df = df.sort_values("best_map50_95", ascending=False, na_position="last")
+    return df.reset_index(drop=True)
+
+
+@timed("eval.collect_runs")
+def collect_runs(roots, METRICS_DIR, force=False, export_artifacts=True):
+    """
+    Incrementally gather every run under `roots` into one consolidated metrics store.
+
+    Only runs whose results.csv/args.yaml changed since the last collection are re-read
+    (and have their curves, confusion matrix and sample predictions exported); the
+    comparison summary is then rebuilt from the store alone. Runs that disappeared
+    from disk are dropped.
+
+    Args:
+        roots: Directories to search, e.g. outputs/ and experiments/
+        METRICS_DIR: Where runs.json, runs_summary.csv and results_<run id>.json go
+            (see artifact_name, e.g. results_experiments__sweep1__train.json)
+        force: Re-read every run regardless of its signature
+        export_artifacts: Also copy plots and sample predictions of updated runs
+
+    Returns:
+        The comparison DataFrame
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    store_path = os.path.join(METRICS_DIR, STORE_NAME)
+    runs = load_store(store_path)
+    found = discover_runs(roots)
+
+    removed = sorted(set(runs) - set(found))
+    for run_id in removed:
+        del runs[run_id]
+
+    updated = []
+    for run_id, run_dir in found.items():
+        previous = runs.get(run_id)
+        if not force and previous is not None and previous.get("signature") == run_signature(run_dir):
+            continue
+        runs[run_id] = record = ingest_run(run_id, run_dir)
+        updated.append(run_id)
+        count("eval.runs_ingested")
+
+        if "last" in record:
+            write_metrics_json(METRICS_DIR, run_id, record["last"])
+            if export_artifacts:
+                training_curves(run_dir, run_id)
+                confusion_matrix(run_dir, run_id)
+                sample_predictions(run_dir)
+
+    save_store(store_path, runs)
+    summary = summary_table(runs)
+    summary.to_csv(os.path.join(METRICS_DIR, SUMMARY_NAME), index=False)
+
+    print(f"Runs: {len(found)} found, {len(updated)} ingested, {len(found) - len(updated)} unchanged, {len(removed)} removed")
+    for run_id in updated:
+        record = runs[run_id]
+        if "best" in record:
+            best = record["best"]
+            print(f"  {run_id:<32s} {record['status']:<9s} best epoch {best['epoch']:>3d}/{record['epochs']:<3d} "
+                  f"mAP50 {best['map50']:.4f}  mAP50-95 {best['map50_95']:.4f}  F1 {best['f1']:.4f}")
+        else:
+            print(f"  {run_id:<32s} {record['status']}")
+    print(f"Summary written to {os.path.join(METRICS_DIR, SUMMARY_NAME)}")
+    return summary
+
 
 if __name__ == "__main__":
     BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     OUTPUTS_DIR = os.path.join(BASE_DIR, "outputs")
+    EXPERIMENTS_DIR = os.path.join(BASE_DIR, "experiments")
     METRICS_DIR = os.path.join(BASE_DIR, "metrics")
 
-    export_results(OUTPUTS_DIR, METRICS_DIR,"baseline")
-
-    export_results(OUTPUTS_DIR, METRICS_DIR,"enhanced_exp1")
\ No newline at end of file
+    # python eval_metrics.py [--force]
+    collect_runs([OUTPUTS_DIR, EXPERIMENTS_DIR], METRICS_DIR, force="--force" in sys.argv[1:])
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from boxes import box_iou
+from format_files import read_yolo_label_array
+from instrumentation import timer, timed
+
+IOU_THRESHOLDS = np.round(np.linspace(0.5, 0.95, 10), 2)
+trapezoid = getattr(np, "trapezoid", None) or np.trapz  # np.trapz is deprecated in NumPy 2
+
+# ====================
+# === Label Loading ==
+# ====================
+
+def xywhn_to_xyxy(boxes):
+    """Normalized (x_center, y_center, width, height) -> normalized corners. IoU is unaffected by the scale."""
+    xy, wh = boxes[:, :2], boxes[:, 2:4]
+    return np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+
+
+def load_label_dir(label_dir):
+    """Load every YOLO .txt in a directory: stem -> array (n, 5) for labels or (n, 6) for predictions."""
+    with timer("eval.load_labels"):
+        return {path.stem: read_yolo_label_array(path, ncols=None) for path in sorted(Path(label_dir).glob("*.txt"))}
+
+
+# ================
+# === Matching ===
+# ================
+
+@timed("eval.match_predictions")
+def match_predictions(gt_classes, gt_boxes, pred_classes, pred_boxes, iou_thresholds=IOU_THRESHOLDS):
+    """
+    Mark each prediction of one image as true/false positive at every IoU threshold.
+
+    Matching is one-to-one and same-class; among candidate pairs the highest IoU wins.
+
+    Returns:
+        bool array (n_pred, n_thresholds)
+    """
+    correct = np.zeros((len(pred_classes), len(iou_thresholds)), dtype=bool)
+    if len(gt_classes) == 0 or len(pred_classes) == 0:
+        return correct
+
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_classes[:, None] == pred_classes[None, :])
+    for ti, threshold in enumerate(iou_thresholds):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if len(gt_idx) == 0:
+            continue
+        order = np.argsort(-iou[gt_idx, pred_idx], kind="stable")
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        _, first = np.unique(pred_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[np.sort(first)], pred_idx[np.sort(first)]
+        _, first = np.unique(gt_idx, return_index=True)
+        correct[pred_idx[first], ti] = True
+    return correct
+
+
+def check_class_ids(stem, gt_classes, pred_classes, nc):
+    """Raise ValueError naming the label file and class when a class id is not in 0..nc-1."""
+    for kind, classes in (("ground-truth", gt_classes), ("prediction", pred_classes)):
+        bad = classes[(classes < 0) | (classes >= nc)]
+        if len(bad):
+            raise ValueError(f"{kind} label file {stem}.txt has class {int(bad[0])}, but the dataset has "
+                             f"nc={nc} (stale labels, or a model trained with other classes?)")
+
+
+def update_confusion_matrix(matrix, gt_classes, gt_boxes, pred_classes, pred_boxes, iou_threshold=0.5):
+    """
+    Add one image to an (nc + 1) x (nc + 1) confusion matrix (rows: predicted, cols: true).
+
+    The last row/column is background: missed objects and false detections.
+    Class ids must already be in 0..nc-1 (see check_class_ids).
+    """
+    background = matrix.shape[0] - 1
+    matched_gt = np.zeros(len(gt_classes), dtype=bool)
+    matched_pred = np.zeros(len(pred_classes), dtype=bool)
+
+    if len(gt_classes) and len(pred_classes):
+        iou = box_iou(gt_boxes, pred_boxes)
+        gt_idx, pred_idx = np.nonzero(iou > iou_threshold)
+        order = np.argsort(-iou[gt_idx, pred_idx], kind="stable")
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        _, first = np.unique(pred_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[np.sort(first)], pred_idx[np.sort(first)]
+        _, first = np.unique(gt_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[first], pred_idx[first]
+        np.add.at(matrix, (pred_classes[pred_idx], gt_classes[gt_idx]), 1)
+        matched_gt[gt_idx] = True
+        matched_pred[pred_idx] = True
+
+    np.add.at(matrix, (np.full((~matched_gt).sum(), background), gt_classes[~matched_gt]), 1)
+    np.add.at(matrix, (pred_classes[~matched_pred], np.full((~matched_pred).sum(), background)), 1)
+
+
+# ===============
+# === Metrics ===
+# ===============
+
+def average_precision(recall, precision):
+    """COCO-style 101-point interpolated area under the precision/recall curve."""
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    points = np.linspace(0, 1, 101)
+    return float(trapezoid(np.interp(points, mrec, mpre), points))
+
+
+@timed("eval.evaluate")
+def evaluate(gt_labels, pred_labels, nc, conf_threshold=0.25, iou_threshold=0.5):
+    """
+    Score predictions against ground truth.
+
+    Args:
+        gt_labels: Dict stem -> array (n, 5): class, x_center, y_center, width, height (normalized)
+        pred_labels: Dict stem -> array (n, 6): same plus confidence; images without predictions may be missing
+        nc: Number of classes
+        conf_threshold: Minimum confidence for precision/recall/F1 and the confusion matrix
+            (AP always uses every prediction)
+        iou_threshold: IoU threshold for precision/recall/F1, the confusion matrix and "ap"
+
+    Returns:
+        Dict with per-class and mean precision, recall, f1, ap (at iou_threshold), ap50,
+        ap50_95 and the confusion matrix
+    """
+    iou_thresholds = np.unique(np.append(IOU_THRESHOLDS, round(iou_threshold, 2)))
+    op = int(np.searchsorted(iou_thresholds, round(iou_threshold, 2)))
+    at50 = int(np.searchsorted(iou_thresholds, 0.5))
+    standard = np.searchsorted(iou_thresholds, IOU_THRESHOLDS)
+    all_correct, all_conf, all_pred_cls, all_gt_cls = [], [], [], []
+    matrix = np.zeros((nc + 1, nc + 1), dtype=np.int64)
+
+    for stem in sorted(set(gt_labels) | set(pred_labels)):
+        gt = gt_labels.get(stem, np.empty((0, 5)))
+        pred = pred_labels.get(stem, np.empty((0, 6)))
+        gt_classes, gt_boxes = gt[:, 0].astype(np.int64), xywhn_to_xyxy(gt[:, 1:5])
+        pred_classes, pred_boxes = pred[:, 0].astype(np.int64), xywhn_to_xyxy(pred[:, 1:5])
+        pred_conf = pred[:, 5] if pred.shape[1] > 5 else np.ones(len(pred))
+        check_class_ids(stem, gt_classes, pred_classes, nc)
+
+        all_correct.append(match_predictions(gt_classes, gt_boxes, pred_classes, pred_boxes, iou_thresholds))
+        all_conf.append(pred_conf)
+        all_pred_cls.append(pred_classes)
+        all_gt_cls.append(gt_classes)
+
+        keep = pred_conf >= conf_threshold
+        update_confusion_matrix(matrix, gt_classes, gt_boxes, pred_classes[keep], pred_boxes[keep], iou_threshold)
+
+    correct = np.concatenate(all_correct) if all_correct else np.zeros((0, len(iou_thresholds)), dtype=bool)
+    conf = np.concatenate(all_conf) if all_conf else np.zeros(0)
+    pred_cls = np.concatenate(all_pred_cls) if all_pred_cls else np.zeros(0, dtype=np.int64)
+    gt_cls = np.concatenate(all_gt_cls) if all_gt_cls else np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(-conf, kind="stable")
+    correct, conf, pred_cls = correct[order], conf[order], pred_cls[order]
+
+    per_class = {}
+    for c in range(nc):
+        n_gt = int((gt_cls == c).sum())
+        mask = pred_cls == c
+        tp = correct[mask]
+        tpc = np.cumsum(tp, axis=0)
+        fpc = np.cumsum(~tp, axis=0)
+        recall_curve = tpc / max(n_gt, 1)
+        precision_curve = tpc / np.maximum(tpc + fpc, 1)
+        aps = [average_precision(recall_curve[:, t], precision_curve[:, t]) if n_gt and len(tp) else 0.0
+               for t in range(len(iou_thresholds))]
+
+        at_conf = tp[conf[mask] >= conf_threshold, op]
+        tp_count = int(at_conf.sum())
+        precision = tp_count / len(at_conf) if len(at_conf) else 0.0
+        recall = tp_count / n_gt if n_gt else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_class[c] = {
+            "instances": n_gt,
+            "predictions": int(mask.sum()),
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "ap": aps[op],
+            "ap50": aps[at50],
+            "ap50_95": float(np.mean([aps[t] for t in standard])),
+        }
+
+    present = [m for m in per_class.values() if m["instances"]] or list(per_class.values())
+    mean = {key: float(np.mean([m[key] for m in present])) if present else 0.0
+            for key in ("precision", "recall", "f1", "ap", "ap50", "ap50_95")}
+    return {"per_class": per_class, "mean": mean, "confusion_matrix": matrix.tolist(),
+            "conf_threshold": conf_threshold, "iou_threshold": iou_threshold}
+
+
+def load_class_names(data_yaml):
+    with open(data_yaml, "r") as f:
+        names = yaml.safe_load(f)["names"]
+    return dict(enumerate(names)) if isinstance(names, list) else {int(k): v for k, v in names.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate YOLO prediction label files against ground truth")
+    parser.add_argument("gt_dir", help="Ground-truth YOLO labels, e.g. data/yolo_dataset/labels/test")
+    parser.add_argument("pred_dir", help="Predicted YOLO labels with confidence (infer.py --save-labels)")
+    parser.add_argument("--data", default=os.path.join("data", "yolo_dataset", "dataset.yaml"), help="dataset.yaml with class names")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU threshold for P/R/F1, AP and the confusion matrix")
+    parser.add_argument("--out", help="Write the metrics to this JSON file")
+    args = parser.parse_args()
+
+    names = load_class_names(args.data)
+    metrics = evaluate(load_label_dir(args.gt_dir), load_label_dir(args.pred_dir), len(names), args.conf, args.iou)
+    metrics["per_class"] = {names[c]: m for c, m in metrics["per_class"].items()}
+    metrics["names"] = [names[c] for c in sorted(names)]
+
+    print(f"{'class':<16s} {'inst':>6s} {'P':>7s} {'R':>7s} {'F1':>7s} {'AP50':>7s} {'AP50-95':>8s}")
+    for name, m in metrics["per_class"].items():
+        print(f"{name:<16s} {m['instances']:>6d} {m['precision']:>7.3f} {m['recall']:>7.3f} {m['f1']:>7.3f} "
+              f"{m['ap50']:>7.3f} {m['ap50_95']:>8.3f}")
+    m = metrics["mean"]
+    print(f"{'all':<16s} {'':>6s} {m['precision']:>7.3f} {m['recall']:>7.3f} {m['f1']:>7.3f} {m['ap50']:>7.3f} {m['ap50_95']:>8.3f}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(metrics, f, indent=4)
+        print(f"Saved metrics to {args.out}")
@@ -1,11 +1,21 @@
 import os
+import sys
 import cv2
+import json
 import yaml
+import hashlib
 import glob
+import threading
 import numpy as np
 from PIL import Image
-import shutil
 from pathlib import Path
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from file_ops import materialize_file
+from instrumentation import timer, count
 
 # ===============================
 # === Image Processing Helpers ==
@@ -22,10 +32,10 @@ def Image_rescaling(img_object):
     else:
         return img_array
 
-def Image_contrased_enhancemend(img_object):
+def Image_contrased_enhancemend(img_object, clip_limit=2.0, tile_grid=8):
     img_Lab = cv2.cvtColor(img_object, cv2.COLOR_BGR2LAB)
     l, a, b = cv2.split(img_Lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid, tile_grid))
     l_clahe = clahe.apply(l)
     img_Lab_clahe = cv2.merge([l_clahe, a, b])
     img_enhanced = cv2.cvtColor(img_Lab_clahe, cv2.COLOR_LAB2BGR)
@@ -53,36 +63,550 @@ def remove_noise(img, method="bilateral"):
         raise ValueError("Invalid method. Choose from: 'gaussian', 'median', 'bilateral', 'fastNlMeans'.")
     return denoised
 
-def Image_Processing_main(file_path: str):
+# Each stage is computed from exactly one earlier stage; "original" is the decoded image.
+PIPELINE_STAGES = {
+    "enhanced": ("original", Image_contrased_enhancemend),
+    "denoised": ("enhanced", remove_noise),
+    "lab": ("denoised", Image_convertion_Lab),
+    "hsv": ("denoised", Image_convertion_HSV),
+    "rescaled": ("denoised", Image_rescaling),
+}
+
+# Order of the tuple returned by Image_Processing_main when no outputs are requested
+DEFAULT_OUTPUTS = ("original", "rescaled", "enhanced", "lab", "hsv")
+
+
+def run_pipeline(img_original, outputs, stage_kwargs=None, tile_workers=0):
+    """
+    Run only the stages needed for the requested outputs.
+
+    Every stage is computed at most once and shared by all outputs that depend on it,
+    e.g. asking for "lab" and "hsv" runs CLAHE and denoising a single time.
+
+    Args:
+        img_original: BGR uint8 image
+        outputs: Iterable of stage names ("original" or a key of PIPELINE_STAGES)
+        stage_kwargs: Optional dict mapping stage name to extra keyword arguments,
+            e.g. {"denoised": {"method": "median"}}
+        tile_workers: Split each stage of this one image over that many threads
+            (see run_stage_tiled); 0 or 1 processes the whole frame at once
+
+    Returns:
+        Dict mapping each requested output name to its image
+    """
+    stage_kwargs = stage_kwargs or {}
+    computed = {"original": img_original}
+
+    def compute(name):
+        if name not in computed:
+            if name not in PIPELINE_STAGES:
+                raise ValueError(f"Unknown pipeline output '{name}'. Choose from: {['original', *PIPELINE_STAGES]}")
+            source, func = PIPELINE_STAGES[name]
+            source_img = compute(source)
+            with timer(f"preprocess.{name}"):
+                if tile_workers > 1:
+                    computed[name] = run_stage_tiled(name, source_img, stage_kwargs.get(name, {}), tile_workers)
+                else:
+                    computed[name] = func(source_img, **stage_kwargs.get(name, {}))
+        return computed[name]
+
+    return {name: compute(name) for name in outputs}
+
+
+# =================================
+# === Tile-parallel Execution =====
+# =================================
+#
+# For one large board at a time, each stage can be split into horizontal bands that run
+# on a thread pool (OpenCV releases the GIL). A band is filtered together with `halo`
+# extra rows above and below it, at least the filter radius, and only its own rows are
+# kept, so every output pixel sees the same neighbourhood as in the whole frame and the
+# stitched result is identical to it. Bands touching the top or bottom edge get OpenCV's
+# usual border handling there, exactly like the whole frame does.
+
+# Rows of context remove_noise needs around each output row
+DENOISE_HALO = {
+    "gaussian": 2,       # 5x5 kernel
+    "median": 2,         # 5x5 aperture
+    "bilateral": 4,      # d=9
+    "fastNlMeans": 13,   # 7x7 template compared across a 21x21 search window: 3 + 10
+}
+
+# Bands thinner than this cost more in halo rows and scheduling than they save
+MIN_TILE_ROWS = 64
+
+_tile_pools = {}
+
+
+def _tile_pool(workers):
+    """Thread pool kept alive between images, so per-image latency doesn't include thread start-up."""
+    if workers not in _tile_pools:
+        _tile_pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile")
+    return _tile_pools[workers]
+
+
+def stage_halo(name, kwargs):
+    """
+    Rows of context a stage needs around each output row, or None when it has to see the whole frame.
+
+    Colour conversions are per pixel. Rescaling decides on the frame's maximum, and CLAHE
+    equalizes over a tile grid laid out on the whole frame, so neither splits exactly
+    (run_stage_tiled still bands CLAHE's colour conversions).
+    """
+    if name in ("lab", "hsv"):
+        return 0
+    if name == "denoised":
+        return DENOISE_HALO.get(kwargs.get("method", "bilateral"))
+    return None
+
+
+def row_bands(height, n_bands, halo=0, min_rows=MIN_TILE_ROWS):
+    """
+    Split `height` rows into at most n_bands bands of near-equal height.
+
+    Returns:
+        List of (y0, y1, top, bottom): the band's own rows [y0, y1) and the rows
+        [top, bottom) to read, i.e. the band plus `halo` rows clipped to the image
+    """
+    n_bands = max(1, min(n_bands, height // max(1, min_rows)))
+    edges = [round(i * height / n_bands) for i in range(n_bands + 1)]
+    return [(y0, y1, max(0, y0 - halo), min(height, y1 + halo)) for y0, y1 in zip(edges, edges[1:])]
+
+
+def apply_banded(func, img, halo, workers, **kwargs):
+    """
+    Apply func(img, **kwargs) band by band on the tile thread pool and stitch the bands.
+
+    Args:
+        func: Filter returning an image with the same number of rows as its input
+        img: Image to filter
+        halo: Rows of context func needs around each output row (its filter radius)
+        workers: Threads, and the number of bands
+    """
+    bands = row_bands(img.shape[0], workers, halo)
+    if len(bands) == 1:
+        return func(img, **kwargs)
+
+    def run(band):
+        y0, y1, top, bottom = band
+        return func(img[top:bottom], **kwargs)[y0 - top:y1 - top]
+
+    return np.concatenate(list(_tile_pool(workers).map(run, bands)))
+
+
+def run_stage_tiled(name, img, kwargs, workers):
+    """Compute one PIPELINE_STAGES stage over row bands; the result equals the whole-frame one."""
+    func = PIPELINE_STAGES[name][1]
+    if name == "enhanced":
+        return _enhance_banded(img, workers, **kwargs)
+    halo = stage_halo(name, kwargs)
+    if halo is None:
+        return func(img, **kwargs)
+    return apply_banded(func, img, halo, workers, **kwargs)
+
+
+def _enhance_banded(img, workers, clip_limit=2.0, tile_grid=8):
+    """Image_contrased_enhancemend with both colour conversions run in bands; CLAHE sees the whole L plane."""
+    img_Lab = apply_banded(cv2.cvtColor, img, 0, workers, code=cv2.COLOR_BGR2LAB)
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid, tile_grid))
+    img_Lab[..., 0] = clahe.apply(np.ascontiguousarray(img_Lab[..., 0]))
+    return apply_banded(cv2.cvtColor, img_Lab, 0, workers, code=cv2.COLOR_LAB2BGR)
+
+
+def Image_Processing_main(file_path: str, outputs=None, stage_kwargs=None, raise_errors=False, tile_workers=0):
+    """
+    Load an image and run the preprocessing pipeline on it.
+
+    Without `outputs` every variant is computed and returned as the tuple
+    (original, rescaled, enhanced, lab, hsv). With `outputs`, only the stages those
+    outputs depend on run and a dict keyed by output name is returned.
+    With tile_workers > 1 each stage of the image is split over that many threads,
+    which lowers the latency of a single large board (see run_stage_tiled).
+    """
     try:
-        img_original = cv2.imread(file_path)
+        with timer("preprocess.decode"):
+            img_original = cv2.imread(file_path)
         if img_original is None:
             raise FileNotFoundError(f"Image not loaded: {file_path}")
 
-        img_enhanced = Image_contrased_enhancemend(img_original)
-        img_denoised = remove_noise(img_enhanced)
-        img_lab = Image_convertion_Lab(img_denoised)
-        img_hsv = Image_convertion_HSV(img_denoised)
-        img_rescaled_RGB = Image_rescaling(img_denoised)
-
-        return img_original, img_rescaled_RGB, img_enhanced, img_lab, img_hsv
+        if outputs is None:
+            result = run_pipeline(img_original, DEFAULT_OUTPUTS, stage_kwargs, tile_workers)
+            return tuple(result[name] for name in DEFAULT_OUTPUTS)
+        return run_pipeline(img_original, outputs, stage_kwargs, tile_workers)
 
     except FileNotFoundError:
+        if raise_errors:
+            raise
         print(f"Error: File not found or could not be loaded at {file_path}")
         return None
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"An error occurred processing {file_path}: {e}")
         return None
 
+# =================================
+# === Preprocessing Engine ========
+# =================================
+
+class PreprocessingEngine:
+    """
+    Stateful version of the pipeline for processing many images in a row.
+
+    It creates its CLAHE instance once and keeps scratch and output buffers per image
+    shape, so once it has seen a shape, processing another image of that shape makes no
+    frame-sized allocations: colour conversions, channel extraction and filters all
+    write into the existing uint8 buffers, and rescaling writes float32 (or float16)
+    instead of a float64 copy. Results are the same as the module-level functions
+    except for the rescaled dtype.
+
+    Returned images are the engine's own buffers and are overwritten by the next call
+    with the same shape; copy them (or pass `out`) to keep them. An engine is not
+    thread-safe: use one per worker process or thread (see get_engine).
+
+    Args:
+        clip_limit, tile_grid: CLAHE clip limit and tile grid size
+        denoise_method: remove_noise method
+        float_dtype: dtype of the rescaled output (np.float32 or np.float16)
+        max_shapes: Number of image shapes to keep buffers for (least recently used dropped)
+    """
+
+    def __init__(self, clip_limit=2.0, tile_grid=8, denoise_method="bilateral", float_dtype=np.float32, max_shapes=4):
+        if denoise_method not in DENOISE_HALO:
+            raise ValueError("Invalid method. Choose from: 'gaussian', 'median', 'bilateral', 'fastNlMeans'.")
+        self.clip_limit = clip_limit
+        self.tile_grid = tile_grid
+        self.denoise_method = denoise_method
+        self.float_dtype = np.dtype(float_dtype)
+        self.max_shapes = max_shapes
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid, tile_grid))
+        self._buffers = OrderedDict()  # image shape -> {buffer name: array}
+
+    @classmethod
+    def from_stage_kwargs(cls, stage_kwargs=None, **kwargs):
+        """Engine matching run_pipeline's stage_kwargs, e.g. {"denoised": {"method": "median"}}."""
+        stage_kwargs = stage_kwargs or {}
+        enhanced = stage_kwargs.get("enhanced", {})
+        return cls(clip_limit=enhanced.get("clip_limit", 2.0), tile_grid=enhanced.get("tile_grid", 8),
+                   denoise_method=stage_kwargs.get("denoised", {}).get("method", "bilateral"), **kwargs)
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """Scratch array `name` for images of `shape`, allocated on first use."""
+        shape = tuple(shape)
+        per_shape = self._buffers.get(shape[:2])
+        if per_shape is None:
+            per_shape = self._buffers[shape[:2]] = {}
+            while len(self._buffers) > self.max_shapes:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(shape[:2])
+        buf = per_shape.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = per_shape[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    # --- stages; each takes a BGR uint8 image ---
+
+    def enhance(self, img, out=None):
+        """CLAHE on the L channel, like Image_contrased_enhancemend."""
+        lab = self.buffer("enhance_lab", img.shape)
+        l = self.buffer("enhance_l", img.shape[:2])
+        l_clahe = self.buffer("enhance_l_clahe", img.shape[:2])
+        cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=l)
+        self.clahe.apply(l, dst=l_clahe)
+        cv2.insertChannel(l_clahe, lab, 0)
+        if out is None:
+            out = self.buffer("enhanced", img.shape)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out)
+
+    def denoise(self, img, out=None):
+        """remove_noise with the engine's method."""
+        if out is None:
+            out = self.buffer("denoised", img.shape)
+        if self.denoise_method == "gaussian":
+            return cv2.GaussianBlur(img, (5, 5), 0, dst=out)
+        if self.denoise_method == "median":
+            return cv2.medianBlur(img, 5, dst=out)
+        if self.denoise_method == "bilateral":
+            return cv2.bilateralFilter(img, d=9, sigmaColor=75, sigmaSpace=75, dst=out)
+        return cv2.fastNlMeansDenoisingColored(img, out, 10, 10, 7, 21)
+
+    def lab(self, img, out=None):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=out if out is not None else self.buffer("lab", img.shape))
+
+    def hsv(self, img, out=None):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=out if out is not None else self.buffer("hsv", img.shape))
+
+    def rescale(self, img, out=None):
+        """Image_rescaling into float_dtype: integer images with values above 1 are divided by 255."""
+        if not (np.issubdtype(img.dtype, np.integer) and img.max() > 1):
+            return img
+        if out is None:
+            out = self.buffer("rescaled", img.shape, self.float_dtype)
+        return np.divide(img, 255, out=out, dtype=out.dtype)
+
+    def run(self, img_original, outputs):
+        """
+        run_pipeline with the engine's stages and buffers.
+
+        Returns:
+            Dict mapping each requested output name to its image (engine buffers, see the class docstring)
+        """
+        stages = {"enhanced": self.enhance, "denoised": self.denoise, "lab": self.lab, "hsv": self.hsv,
+                  "rescaled": self.rescale}
+        computed = {"original": img_original}
+
+        def compute(name):
+            if name not in computed:
+                if name not in stages:
+                    raise ValueError(f"Unknown pipeline output '{name}'. Choose from: {['original', *stages]}")
+                source_img = compute(PIPELINE_STAGES[name][0])
+                with timer(f"preprocess.{name}"):
+                    computed[name] = stages[name](source_img)
+            return computed[name]
+
+        return {name: compute(name) for name in outputs}
+
+
+_engine_local = threading.local()
+
+
+def get_engine(stage_kwargs=None):
+    """
+    This thread's PreprocessingEngine for stage_kwargs, created on first use.
+
+    Pool workers (processes or threads) each end up with their own engine, so buffers
+    are reused across the images a worker handles and never shared between workers.
+    """
+    engines = getattr(_engine_local, "engines", None)
+    if engines is None:
+        engines = _engine_local.engines = {}
+    key = json.dumps(stage_kwargs, sort_keys=True)
+    if key not in engines:
+        engines[key] = PreprocessingEngine.from_stage_kwargs(stage_kwargs)
+    return engines[key]
+
+
 # =================================
 # === Dataset Preprocessing Tool ==
 # =================================
 
-def preprocess_dataset_images(yaml_file):
-    """Reads dataset.yaml and enhances all images in train/val/test."""
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _init_enhance_worker(stage_kwargs=None):
+    # Each pool process already owns a core; stop OpenCV from spawning its own threads on top.
+    cv2.setNumThreads(1)
+    get_engine(stage_kwargs)
+
+
+def _enhance_and_save(task, output="enhanced", stage_kwargs=None):
+    """Enhance one image with this worker's engine and write it to disk. Returns (img_path, error message or None)."""
+    img_path, out_path = task
+    try:
+        with timer("preprocess.decode"):
+            img_original = cv2.imread(img_path)
+        if img_original is None:
+            raise FileNotFoundError(f"Image not loaded: {img_path}")
+        engine = get_engine(stage_kwargs)
+        img_out = engine.run(img_original, (output,))[output]
+        with timer("preprocess.save"):
+            rgb = cv2.cvtColor(img_out, cv2.COLOR_BGR2RGB, dst=engine.buffer("save_rgb", img_out.shape))
+            Image.fromarray(rgb).save(out_path)
+    except Exception as e:
+        count("preprocess.errors")
+        return img_path, f"{type(e).__name__}: {e}"
+    count("preprocess.images")
+    return img_path, None
+
+
+def run_enhance_tasks(tasks, workers=None, chunksize=8, progress_every=50, output="enhanced", stage_kwargs=None):
+    """
+    Run (img_path, out_path) enhancement tasks, optionally on a process pool.
+
+    Results come back in submission order, so progress lines are ordered too.
+
+    Args:
+        tasks: List of (img_path, out_path) tuples
+        workers: Number of worker processes (None = all cores, 1 = run in this process)
+        chunksize: Number of tasks handed to a worker at a time
+        progress_every: Print a progress line every N finished images (0 disables)
+        output: Pipeline stage written to disk ("enhanced" or "denoised")
+        stage_kwargs: Extra keyword arguments per pipeline stage (see run_pipeline)
+
+    Returns:
+        Tuple (processed count, list of (img_path, error message))
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks) or 1))
+    task_fn = partial(_enhance_and_save, output=output, stage_kwargs=stage_kwargs)
+
+    if workers == 1:
+        results = map(task_fn, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_enhance_worker, initargs=(stage_kwargs,))
+        results = pool.map(task_fn, tasks, chunksize=max(1, chunksize))
+
+    processed = 0
+    errors = []
+    try:
+        for done, (img_path, error) in enumerate(results, start=1):
+            if error is None:
+                processed += 1
+            else:
+                errors.append((img_path, error))
+            if progress_every and (done % progress_every == 0 or done == len(tasks)):
+                print(f"  [{done}/{len(tasks)}] {os.path.basename(img_path)}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return processed, errors
+
+
+# ======================================
+# === Incremental Enhancement Manifest ==
+# ======================================
+
+MANIFEST_NAME = "manifest.json"
+ENHANCED_ROOT = os.path.join("data", "enhanced_images")
+
+
+def file_sha1(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f).get("entries", {})
+    except (OSError, ValueError) as e:
+        print(f"  Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_manifest(manifest_path, entries):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": 1, "entries": entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_incremental(tasks, entries, params):
+    """
+    Split tasks into the ones that must be (re)computed and the ones whose output is current.
+
+    An output is current when the manifest has it for the same source, the same
+    preprocessing parameters and the same source content. Size and mtime are checked
+    first so unchanged files are never re-hashed.
+
+    Returns:
+        Tuple (tasks to run, number of up-to-date outputs, dict out_path -> new manifest entry)
+    """
+    todo = []
+    fresh = {}
+    up_to_date = 0
+    for img_path, out_path in tasks:
+        st = os.stat(img_path)
+        entry = entries.get(out_path)
+        candidate = {"source": img_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "params": params}
+
+        if entry and entry.get("source") == img_path and entry.get("params") == params and os.path.exists(out_path):
+            if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+                up_to_date += 1
+                continue
+            candidate["sha1"] = file_sha1(img_path)
+            if candidate["sha1"] == entry.get("sha1"):
+                entries[out_path] = dict(candidate, split=entry.get("split"))  # touched but identical, refresh the stat
+                up_to_date += 1
+                continue
+        else:
+            candidate["sha1"] = file_sha1(img_path)
+
+        todo.append((img_path, out_path))
+        fresh[out_path] = candidate
+
+    return todo, up_to_date, fresh
+
+
+def migrate_enhanced_layout(enhanced_root=ENHANCED_ROOT):
+    """
+    Move outputs of the old layout (enhanced_root/<split>, or the images/<split>/<split>
+    nesting left by rerunning the old patch step) to enhanced_root/images/<split>, where
+    YOLO expects them, and re-key their manifest entries. Safe to run repeatedly.
+    """
+    manifest_path = os.path.join(enhanced_root, MANIFEST_NAME)
+    entries = load_manifest(manifest_path)
+    moved = 0
+    for split in ("train", "val", "test"):
+        target_dir = os.path.join(enhanced_root, "images", split)
+        for legacy_dir in (os.path.join(enhanced_root, split), os.path.join(target_dir, split)):
+            if not os.path.isdir(legacy_dir):
+                continue
+            os.makedirs(target_dir, exist_ok=True)
+            for name in os.listdir(legacy_dir):
+                src, dst = os.path.join(legacy_dir, name), os.path.join(target_dir, name)
+                if not os.path.isfile(src):
+                    continue
+                os.replace(src, dst)
+                if src in entries:
+                    entries[dst] = entries.pop(src)
+                moved += 1
+            if not os.listdir(legacy_dir):
+                os.rmdir(legacy_dir)
+            print(f"Moved {legacy_dir} → {target_dir}")
+    if moved and entries:
+        save_manifest(manifest_path, entries)
+    return moved
+
+
+def preprocess_dataset_images(yaml_file, workers=None, chunksize=8, progress_every=50,
+                              clip_limit=2.0, tile_grid=8, denoise_method="bilateral",
+                              output="enhanced", incremental=True):
+    """
+    Reads dataset.yaml and enhances all images in train/val/test.
+
+    With `incremental`, a manifest in data/enhanced_images records the source hash and
+    preprocessing parameters of every output, so reruns only process new or modified
+    images (or all images when the parameters change) and delete outputs whose source
+    is gone.
+
+    Args:
+        yaml_file: Path to the YOLO dataset.yaml
+        workers: Number of worker processes (None = all cores, 1 = serial)
+        chunksize: Number of images submitted to a worker at a time
+        progress_every: Print a progress line every N images (0 disables)
+        clip_limit, tile_grid: CLAHE clip limit and tile grid size
+        denoise_method: remove_noise method, used when output is "denoised"
+        output: Pipeline stage saved for each image ("enhanced" or "denoised")
+        incremental: Skip images whose output is already up to date
+
+    Returns:
+        List of (img_path, error message) for images that failed
+    """
     with open(yaml_file, 'r') as f:
         ds = yaml.safe_load(f)
 
+    stage_kwargs = {
+        "enhanced": {"clip_limit": clip_limit, "tile_grid": tile_grid},
+        "denoised": {"method": denoise_method},
+    }
+    params = {"clahe_clip": clip_limit, "clahe_tile": tile_grid, "denoise": denoise_method, "output": output}
+    enhanced_root = ENHANCED_ROOT
+    manifest_path = os.path.join(enhanced_root, MANIFEST_NAME)
+    migrate_enhanced_layout(enhanced_root)
+    entries = load_manifest(manifest_path) if incremental else {}
+
+    all_errors = []
     for split in ("train", "val", "test"):
         if split not in ds:
             continue
@@ -98,22 +622,49 @@ def preprocess_dataset_images(yaml_file):
 
         print(f"\n🔹 Processing split: {split} ({split_path})")
         files = glob.glob(os.path.join(split_path, "**", "*.*"), recursive=True)
-        out_root = os.path.join("data", "enhanced_images", split)
+        out_root = os.path.join(enhanced_root, "images", split)
         os.makedirs(out_root, exist_ok=True)
 
-        count = 0
-        for img_path in files:
-            if not img_path.lower().endswith((".jpg", ".jpeg", ".png")):
-                continue
-            result = Image_Processing_main(img_path)
-            if result is None:
-                continue
-            _, _, img_enhanced, _, _ = result
-            out_path = os.path.join(out_root, os.path.basename(img_path))
-            Image.fromarray(cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2RGB)).save(out_path)
-            count += 1
-
-        print(f" {count} images enhanced and saved to {out_root}")
+        tasks = [
+            (img_path, os.path.join(out_root, os.path.basename(img_path)))
+            for img_path in sorted(files)
+            if img_path.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+        if not incremental:
+            processed, errors = run_enhance_tasks(tasks, workers, chunksize, progress_every, output, stage_kwargs)
+            all_errors.extend(errors)
+            print(f" {processed} images enhanced and saved to {out_root}")
+        else:
+            todo, up_to_date, fresh = plan_incremental(tasks, entries, params)
+            print(f"  {up_to_date} up to date, {len(todo)} to enhance")
+            processed, errors = run_enhance_tasks(todo, workers, chunksize, progress_every, output, stage_kwargs)
+            all_errors.extend(errors)
+
+            failed = {img_path for img_path, _ in errors}
+            for img_path, out_path in todo:
+                if img_path in failed:
+                    entries.pop(out_path, None)
+                else:
+                    entries[out_path] = dict(fresh[out_path], split=split)
+
+            # Prune outputs of this split whose source image no longer exists
+            current = {out_path for _, out_path in tasks}
+            stale = [p for p, e in entries.items() if e.get("split") == split and p not in current]
+            for out_path in stale:
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+                del entries[out_path]
+
+            save_manifest(manifest_path, entries)
+            print(f" {processed} images enhanced, {len(stale)} stale outputs removed in {out_root}")
+
+        if errors:
+            print(f" {len(errors)} images failed in {split}:")
+            for img_path, error in errors:
+                print(f"    {img_path}: {error}")
+
+    return all_errors
 
 def resolve_enhanced_yaml():
     enhanced_dir = os.path.join("data", "enhanced_images")
@@ -133,9 +684,7 @@ def resolve_enhanced_yaml():
 
     print(f"Enhanced YAML created at {enhanced_yaml}")
 
-print(f" Enhanced YAML created!")
-
-def resolve_enhanced_labels(): 
+def resolve_enhanced_labels(link_mode='copy'):
     ENHANCED_ROOT = Path("data/enhanced_images")   
     LABELS_ROOT = Path("data/yolo_dataset/labels")
     enhanced_labels_root = Path("data/enhanced_images/labels")
@@ -149,7 +698,7 @@ def resolve_enhanced_labels():
         for img_path in img_dir.glob("*.*"):       
             original_label = LABELS_ROOT / split / f"{img_path.stem}.txt"
             if original_label.exists():
-                shutil.copy2(original_label, target_label_dir / original_label.name)
+                materialize_file(original_label, target_label_dir / original_label.name, link_mode)
             else:
                 print(f"Label missing for {img_path.name} in split {split}")
 
@@ -162,7 +711,9 @@ def resolve_enhanced_labels():
 
 if __name__ == "__main__":
     YAML_PATH = os.path.join("data","yolo_dataset","dataset.yaml" ) 
-    preprocess_dataset_images(YAML_PATH)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    link_mode = sys.argv[2] if len(sys.argv) > 2 else 'copy'
+    preprocess_dataset_images(YAML_PATH, workers=workers)
     resolve_enhanced_yaml()
-    resolve_enhanced_labels()
+    resolve_enhanced_labels(link_mode)
   
\ No newline at end of file
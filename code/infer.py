@@ -1,8 +1,328 @@
 from ultralytics import YOLO
+import os
 import sys
+import json
+import glob
+import queue
+import argparse
+import threading
 
-model_path = sys.argv[1]
-image_path = sys.argv[2]
+import cv2
+import numpy as np
 
-model = YOLO(model_path)
-model.predict(source=image_path, save=True)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from tiling import tile_windows
+from boxes import nms
+from onnx_backend import OnnxDetector
+from instrumentation import timer, timed, count
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+@timed("infer.load_model")
+def load_model(model_path, intra_op_threads=0, inter_op_threads=0, imgsz=640):
+    """Load a PyTorch checkpoint with Ultralytics, or an exported .onnx model with ONNX Runtime."""
+    if str(model_path).endswith(".onnx"):
+        return OnnxDetector(model_path, intra_op_threads, inter_op_threads, imgsz=imgsz)
+    return YOLO(model_path)
+
+
+def model_imgsz(model, imgsz=None):
+    """imgsz to run a model at: the requested one, else a static ONNX export's own size, else 640."""
+    if imgsz:
+        return imgsz
+    if isinstance(model, OnnxDetector) and model.static_size:
+        return max(model.imgsz)
+    return 640
+
+
+def result_to_detections(result):
+    """Convert one Ultralytics result into a list of JSON-serialisable detections."""
+    boxes = result.boxes
+    xyxy = boxes.xyxy.cpu().numpy()
+    conf = boxes.conf.cpu().numpy()
+    cls = boxes.cls.cpu().numpy().astype(int)
+    return [
+        {
+            "class_id": int(c),
+            "class_name": result.names[int(c)],
+            "confidence": float(s),
+            "box": [float(v) for v in box],
+        }
+        for box, s, c in zip(xyxy, conf, cls)
+    ]
+
+
+def detect_batch(model, images, imgsz=640, conf=0.25):
+    """Run a list of BGR images through either backend; returns one detection list per image."""
+    count("infer.images", len(images))
+    with timer("infer.forward"):
+        if isinstance(model, OnnxDetector):
+            return model.detect(images, conf=conf, imgsz=imgsz)
+        results = model.predict(images, imgsz=imgsz, conf=conf, verbose=False)
+    return [result_to_detections(r) for r in results]
+
+
+# ==============================
+# === Tiled (Sliding Window) ===
+# ==============================
+
+def predict_tiled(model, image, tile_size=640, overlap=0.2, batch_size=8, conf=0.25, iou=0.5):
+    """
+    Run detection on overlapping full-resolution tiles of one large image.
+
+    Tiles are sent through the model in batches at their native resolution, boxes are
+    shifted back to image coordinates, and duplicates from overlapping tiles are merged
+    with class-wise NMS.
+
+    Args:
+        model: Loaded model (see load_model)
+        image: BGR image (numpy array)
+        tile_size: Tile side in pixels (also used as the model input size)
+        overlap: Tile overlap, fraction of tile_size (< 1) or pixels (>= 1)
+        batch_size: Tiles per model call
+        conf: Confidence threshold
+        iou: IoU threshold for cross-tile NMS
+
+    Returns:
+        List of detections (see result_to_detections) in image coordinates
+    """
+    h, w = image.shape[:2]
+    windows = tile_windows(h, w, tile_size, overlap)
+
+    detections = []
+    for start in range(0, len(windows), batch_size):
+        batch = windows[start:start + batch_size]
+        crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in batch]
+        for (x0, y0, _, _), tile_detections in zip(batch, detect_batch(model, crops, tile_size, conf)):
+            for det in tile_detections:
+                x1, y1, x2, y2 = det["box"]
+                detections.append(dict(det, box=[x1 + x0, y1 + y0, x2 + x0, y2 + y0]))
+
+    if not detections:
+        return []
+
+    with timer("infer.tile_nms"):
+        keep = nms(
+            np.array([det["box"] for det in detections]),
+            np.array([det["confidence"] for det in detections]),
+            np.array([det["class_id"] for det in detections]),
+            iou,
+        )
+    return [detections[i] for i in keep]
+
+
+def draw_detections(image, detections):
+    out = image.copy()
+    for det in detections:
+        x1, y1, x2, y2 = (int(round(v)) for v in det["box"])
+        cv2.rectangle(out, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        cv2.putText(out, f"{det['class_name']} {det['confidence']:.2f}", (x1, max(0, y1 - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+    return out
+
+
+def write_prediction_labels(label_file, detections, image_shape):
+    """Save detections as YOLO labels with a trailing confidence column (input for evaluate.py)."""
+    h, w = image_shape[:2]
+    with open(label_file, "w") as f:
+        for det in detections:
+            x1, y1, x2, y2 = det["box"]
+            f.write(f"{det['class_id']} {(x1 + x2) / 2 / w:.6f} {(y1 + y2) / 2 / h:.6f} "
+                    f"{(x2 - x1) / w:.6f} {(y2 - y1) / h:.6f} {det['confidence']:.6f}\n")
+
+
+def list_images(source):
+    if os.path.isdir(source):
+        files = glob.glob(os.path.join(source, "**", "*.*"), recursive=True)
+    else:
+        files = glob.glob(source)
+    return sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def run_on_images(model, source, output_dir, tile_kwargs=None, imgsz=640, conf=0.25, labels_dir=None):
+    """
+    Inference over an image, directory or glob, for either backend.
+
+    Writes annotated images to output_dir and prints one JSON line per image.
+    With tile_kwargs, each image goes through predict_tiled. With labels_dir,
+    predictions are also saved as YOLO label files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if labels_dir:
+        os.makedirs(labels_dir, exist_ok=True)
+    for image_path in list_images(source):
+        with timer("infer.decode"):
+            image = cv2.imread(image_path)
+        if image is None:
+            print(f"Warning: Could not read {image_path}", file=sys.stderr)
+            continue
+        if tile_kwargs:
+            detections = predict_tiled(model, image, conf=conf, **tile_kwargs)
+        else:
+            detections = detect_batch(model, [image], imgsz, conf)[0]
+        cv2.imwrite(os.path.join(output_dir, os.path.basename(image_path)), draw_detections(image, detections))
+        if labels_dir:
+            stem = os.path.splitext(os.path.basename(image_path))[0]
+            write_prediction_labels(os.path.join(labels_dir, f"{stem}.txt"), detections, image.shape)
+        print(json.dumps({"image": image_path, "detections": detections}))
+
+
+# ==================================
+# === Streaming (Directory/Video) ===
+# ==================================
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+
+def iter_frames(source):
+    """
+    Yield (frame_id, BGR frame) from a directory, glob, image, video file or camera index.
+
+    Images are decoded one at a time, so memory does not depend on how many there are.
+    """
+    if str(source).isdigit() or str(source).lower().endswith(VIDEO_EXTENSIONS):
+        capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        try:
+            index = 0
+            while True:
+                with timer("infer.decode"):
+                    ok, frame = capture.read()
+                if not ok:
+                    break
+                yield f"{source}#{index}", frame
+                index += 1
+        finally:
+            capture.release()
+        return
+
+    for image_path in list_images(source):
+        with timer("infer.decode"):
+            frame = cv2.imread(image_path)
+        if frame is None:
+            print(f"Warning: Could not read {image_path}", file=sys.stderr)
+            continue
+        yield image_path, frame
+
+
+def prefetch(iterable, size=8):
+    """Run an iterator on a background thread, buffering at most `size` items ahead."""
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        buffer.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            buffer.put(e)
+        buffer.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def stream_predict(model, source, batch_size=4, prefetch_size=8, imgsz=640, conf=0.25, tile_kwargs=None):
+    """
+    Yield (frame_id, frame, detections) for every frame of a source, as soon as each batch is done.
+
+    Decoding runs on a background thread with a bounded queue, so it overlaps with
+    model compute while keeping at most prefetch_size frames in memory.
+    """
+    batch = []
+    for item in prefetch(iter_frames(source), prefetch_size):
+        batch.append(item)
+        if len(batch) < batch_size and not tile_kwargs:
+            continue
+        yield from _predict_frames(model, batch, imgsz, conf, tile_kwargs)
+        batch = []
+    if batch:
+        yield from _predict_frames(model, batch, imgsz, conf, tile_kwargs)
+
+
+def _predict_frames(model, batch, imgsz, conf, tile_kwargs):
+    if tile_kwargs:
+        results = [predict_tiled(model, frame, conf=conf, **tile_kwargs) for _, frame in batch]
+    else:
+        results = detect_batch(model, [frame for _, frame in batch], imgsz, conf)
+    for (frame_id, frame), detections in zip(batch, results):
+        yield frame_id, frame, detections
+
+
+def run_stream(model, source, jsonl_path, annotated_dir=None, labels_dir=None, **stream_kwargs):
+    """Stream a source through the model, appending one JSON line per frame to jsonl_path."""
+    os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+    for directory in (annotated_dir, labels_dir):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    n_frames = 0
+    with open(jsonl_path, "w") as f:
+        for frame_id, frame, detections in stream_predict(model, source, **stream_kwargs):
+            f.write(json.dumps({"frame": frame_id, "detections": detections}) + "\n")
+            f.flush()
+            name = os.path.basename(frame_id).replace("#", "_")
+            if annotated_dir:
+                image_name = name if name.lower().endswith(IMAGE_EXTENSIONS) else f"{name}.jpg"
+                cv2.imwrite(os.path.join(annotated_dir, image_name), draw_detections(frame, detections))
+            if labels_dir:
+                stem = os.path.splitext(name)[0] if name.lower().endswith(IMAGE_EXTENSIONS) else name
+                write_prediction_labels(os.path.join(labels_dir, f"{stem}.txt"), detections, frame.shape)
+            n_frames += 1
+    print(f"Wrote detections for {n_frames} frames to {jsonl_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run YOLO inference on PCB images")
+    parser.add_argument("model_path", help="PyTorch .pt checkpoint or exported .onnx model")
+    parser.add_argument("image_path", help="Image, directory or glob (or video file / camera index with --stream)")
+    parser.add_argument("--tile", type=int, default=0, help="Tile size for sliding-window inference (0 = off)")
+    parser.add_argument("--overlap", type=float, default=0.2, help="Tile overlap, fraction (<1) or pixels")
+    parser.add_argument("--batch", type=int, default=8, help="Tiles (or streamed frames) per model call")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU threshold for cross-tile NMS")
+    parser.add_argument("--imgsz", type=int, help="Model input size (default 640, or a static ONNX export's size)")
+    parser.add_argument("--intra-threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = default)")
+    parser.add_argument("--inter-threads", type=int, default=0, help="ONNX Runtime inter-op threads (0 = default)")
+    parser.add_argument("--output-dir", default=os.path.join("runs", "infer"))
+    parser.add_argument("--stream", metavar="JSONL", help="Stream the source and write detections to this JSONL file")
+    parser.add_argument("--prefetch", type=int, default=8, help="Frames decoded ahead in --stream mode")
+    parser.add_argument("--save-annotated", action="store_true", help="Also write annotated frames in --stream mode")
+    parser.add_argument("--save-labels", metavar="DIR", help="Also save predictions as YOLO label files (for evaluate.py)")
+    args = parser.parse_args()
+
+    model = load_model(args.model_path, args.intra_threads, args.inter_threads, imgsz=args.imgsz or 640)
+    args.imgsz = model_imgsz(model, args.imgsz)
+    tile_kwargs = None
+    if args.tile:
+        tile_kwargs = {"tile_size": args.tile, "overlap": args.overlap, "batch_size": args.batch, "iou": args.iou}
+
+    if args.stream:
+        run_stream(model, args.image_path, args.stream, args.output_dir if args.save_annotated else None,
+                   args.save_labels, batch_size=args.batch, prefetch_size=args.prefetch, imgsz=args.imgsz,
+                   conf=args.conf, tile_kwargs=tile_kwargs)
+    elif args.tile:
+        run_on_images(model, args.image_path, args.output_dir, tile_kwargs, conf=args.conf, labels_dir=args.save_labels)
+    elif isinstance(model, OnnxDetector) or args.save_labels:
+        run_on_images(model, args.image_path, args.output_dir, imgsz=args.imgsz, conf=args.conf,
+                      labels_dir=args.save_labels)
+    else:
+        model.predict(source=args.image_path, save=True)
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from infer import load_model, detect_batch, model_imgsz
+from instrumentation import observe, count, snapshot, to_prometheus
+
+# ===================================
+# === Micro-batching Model Worker ===
+# ===================================
+
+class MicroBatcher:
+    """
+    Keeps one model resident and runs concurrent requests through it in small batches.
+
+    A batch is closed when it reaches `max_batch` images or when the oldest request in
+    it has waited `max_latency_ms`, whichever comes first.
+    """
+
+    def __init__(self, model, max_batch=8, max_latency_ms=10, imgsz=640, conf=0.25):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self.imgsz = imgsz
+        self.conf = conf
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Queue a BGR image; returns a Future resolving to its list of detections."""
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            images = [image for image, _, _ in batch]
+            now = time.perf_counter()
+            for _, _, queued in batch:
+                observe("serve.queue_wait", now - queued)
+            count("serve.batches")
+            try:
+                results = detect_batch(self.model, images, self.imgsz, self.conf)
+                for (_, future, _), detections in zip(batch, results):
+                    future.set_result(detections)
+            except Exception as e:
+                count("serve.errors")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+
+# =====================
+# === HTTP Frontend ===
+# =====================
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health   -> {"status": "ok"}
+    GET  /metrics  -> Prometheus text (populated when PCB_METRICS is set)
+    POST /predict  -> {"detections": [...]}
+        body: raw encoded image bytes, or JSON {"path": "<image file>"}
+    """
+
+    batcher = None
+    # Max wait for a batched prediction; not `timeout`, which StreamRequestHandler uses as
+    # the socket timeout and would drop idle keep-alive connections
+    predict_timeout = 60.0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_image(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            payload = json.loads(body)
+            if not isinstance(payload, dict) or not isinstance(payload.get("path"), str):
+                raise ValueError('JSON body must be an object {"path": "<image file>"}')
+            path = payload["path"]
+            image = cv2.imread(path)
+            if image is None:
+                raise ValueError(f"Image not loaded: {path}")
+            return image
+        image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Request body is not a decodable image")
+        return image
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            body = to_prometheus(snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            image = self._read_image()
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            detections = self.batcher.submit(image).result(timeout=self.predict_timeout)
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, {"detections": detections})
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(model_path, host="127.0.0.1", port=8000, unix_socket=None, max_batch=8, max_latency_ms=10,
+          imgsz=None, conf=0.25, intra_op_threads=0, inter_op_threads=0):
+    """
+    Load the model once (.pt or .onnx) and serve predictions until interrupted.
+
+    imgsz defaults to 640, or to the input size of a static ONNX export.
+    """
+    model = load_model(model_path, intra_op_threads, inter_op_threads, imgsz=imgsz or 640)
+    imgsz = model_imgsz(model, imgsz)
+    # Warm up so the first real request doesn't pay for lazy initialisation
+    detect_batch(model, [np.zeros((imgsz, imgsz, 3), dtype=np.uint8)], imgsz, conf)
+    InferenceHandler.batcher = MicroBatcher(model, max_batch, max_latency_ms, imgsz, conf)
+
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, InferenceHandler)
+        where = unix_socket
+    else:
+        server = ThreadingHTTPServer((host, port), InferenceHandler)
+        where = f"http://{host}:{port}"
+
+    print(f"Serving {model_path} on {where} (max_batch={max_batch}, max_latency_ms={max_latency_ms})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent YOLO inference service")
+    parser.add_argument("model_path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-latency-ms", type=float, default=10)
+    parser.add_argument("--imgsz", type=int, help="Model input size (default 640, or a static ONNX export's size)")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--intra-threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = default)")
+    parser.add_argument("--inter-threads", type=int, default=0, help="ONNX Runtime inter-op threads (0 = default)")
+    args = parser.parse_args()
+
+    serve(
+        args.model_path,
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        max_batch=args.max_batch,
+        max_latency_ms=args.max_latency_ms,
+        imgsz=args.imgsz,
+        conf=args.conf,
+        intra_op_threads=args.intra_threads,
+        inter_op_threads=args.inter_threads,
+    )
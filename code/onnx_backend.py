@@ -0,0 +1,224 @@
+import os
+import ast
+import sys
+import glob
+import math
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from boxes import box_iou, nms
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUTS_DIR = os.path.join(BASE_DIR, "outputs")
+STRIDE = 32  # largest YOLOv8 stride; dynamic input sizes must be multiples of it
+
+# ===============================
+# === ONNX Runtime Detector =====
+# ===============================
+
+class OnnxDetector:
+    """
+    YOLOv8 detector running an exported ONNX model on ONNX Runtime (CPU).
+
+    Produces the same detection dicts as infer.result_to_detections.
+
+    Args:
+        model_path: Path to the .onnx file
+        intra_op_threads: Threads used inside one operator (0 = ONNX Runtime default)
+        inter_op_threads: Threads used to run independent operators in parallel (0 = default)
+        imgsz: Default input size when the model has dynamic input axes (see detect)
+    """
+
+    def __init__(self, model_path, intra_op_threads=0, inter_op_threads=0, imgsz=640):
+        import onnxruntime as ort  # optional dependency, only needed for this backend
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        height, width = model_input.shape[2:4]
+        self.static_size = isinstance(height, int) and isinstance(width, int)
+        self.imgsz = (height, width) if self.static_size else self.input_size(imgsz)
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+    def input_size(self, imgsz):
+        """
+        (height, width) fed to the model for a requested imgsz.
+
+        Dynamic exports take any multiple of the model stride (rounded up, as Ultralytics
+        does); a static export only runs at the size it was exported with.
+        """
+        if imgsz is None:
+            return self.imgsz
+        if self.static_size:
+            if imgsz != max(self.imgsz):
+                raise ValueError(f"Model was exported with a fixed input size {self.imgsz}, got imgsz={imgsz}; "
+                                 f"re-export it with that imgsz or with dynamic=True")
+            return self.imgsz
+        size = int(math.ceil(imgsz / STRIDE) * STRIDE)
+        return size, size
+
+    def _letterbox(self, image, size):
+        h, w = image.shape[:2]
+        new_h, new_w = size
+        ratio = min(new_h / h, new_w / w)
+        resized_w, resized_h = int(round(w * ratio)), int(round(h * ratio))
+        pad_x, pad_y = (new_w - resized_w) / 2, (new_h - resized_h) / 2
+        if (resized_w, resized_h) != (w, h):
+            image = cv2.resize(image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+        left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return image, ratio, (left, top)
+
+    def _postprocess(self, output, ratio, pad, shape, conf, iou, max_det):
+        preds = output.T  # (anchors, 4 + nc)
+        scores_all = preds[:, 4:]
+        classes = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(preds)), classes]
+        mask = scores >= conf
+        preds, classes, scores = preds[mask], classes[mask], scores[mask]
+
+        cx, cy, bw, bh = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        keep = nms(boxes, scores, classes, iou)[:max_det]
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+        boxes -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=boxes.dtype)
+        boxes /= ratio
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+        return [
+            {
+                "class_id": int(c),
+                "class_name": self.names.get(int(c), str(int(c))),
+                "confidence": float(s),
+                "box": [float(v) for v in box],
+            }
+            for box, s, c in zip(boxes, scores, classes)
+        ]
+
+    def detect(self, images, conf=0.25, iou=0.7, max_det=300, imgsz=None):
+        """
+        Run detection on a list of BGR images.
+
+        Args:
+            imgsz: Model input size for this call (default: the size given at construction)
+
+        Returns:
+            One list of detections per image
+        """
+        size = self.input_size(imgsz)
+        prepared = [self._letterbox(image, size) for image in images]
+        batch = np.stack([im for im, _, _ in prepared])[..., ::-1]  # BGR -> RGB
+        batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input_name: x[None]})[0] for x in batch])
+
+        return [
+            self._postprocess(output, ratio, pad, image.shape[:2], conf, iou, max_det)
+            for output, (_, ratio, pad), image in zip(outputs, prepared, images)
+        ]
+
+
+# ==========================
+# === Export and Parity ====
+# ==========================
+
+def resolve_weights(run_or_weights):
+    """Accept a .pt file, a run directory or a run name under outputs/ and return the checkpoint."""
+    if os.path.isfile(run_or_weights):
+        return run_or_weights
+    run_dir = run_or_weights if os.path.isdir(run_or_weights) else os.path.join(OUTPUTS_DIR, run_or_weights)
+    for name in ("best.pt", "last.pt"):
+        weights = os.path.join(run_dir, "weights", name)
+        if os.path.exists(weights):
+            return weights
+    raise FileNotFoundError(f"No weights found for {run_or_weights}")
+
+
+def export_onnx(run_or_weights, imgsz=640, dynamic=True, simplify=True):
+    """Export a trained checkpoint to ONNX next to it and return the .onnx path."""
+    from ultralytics import YOLO
+
+    weights = resolve_weights(run_or_weights)
+    onnx_path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=simplify)
+    print(f"Exported {weights} -> {onnx_path}")
+    return onnx_path
+
+
+def check_parity(pt_path, onnx_path, images, conf=0.25, iou_threshold=0.9, conf_tolerance=0.05):
+    """
+    Compare detections of the PyTorch and ONNX models on the same images.
+
+    Detections are paired greedily by class and IoU; every detection must have a
+    partner with IoU >= iou_threshold and confidence within conf_tolerance.
+
+    Returns:
+        True when all images match
+    """
+    from infer import load_model, result_to_detections
+
+    torch_model = load_model(pt_path)
+    onnx_model = OnnxDetector(onnx_path)
+    ok = True
+    for image_path in images:
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"  Warning: Could not read {image_path}")
+            continue
+        imgsz = max(onnx_model.imgsz)
+        expected = result_to_detections(torch_model.predict(image, imgsz=imgsz, conf=conf, verbose=False)[0])
+        actual = onnx_model.detect([image], conf=conf)[0]
+
+        unmatched = 0
+        worst_conf = 0.0
+        used = set()
+        for det in expected:
+            candidates = [i for i, a in enumerate(actual) if i not in used and a["class_id"] == det["class_id"]]
+            if candidates:
+                ious = box_iou([det["box"]], [actual[i]["box"] for i in candidates])[0]
+                best = int(ious.argmax())
+                if ious[best] >= iou_threshold:
+                    used.add(candidates[best])
+                    worst_conf = max(worst_conf, abs(actual[candidates[best]]["confidence"] - det["confidence"]))
+                    continue
+            unmatched += 1
+        extra = len(actual) - len(used)
+
+        match = unmatched == 0 and extra == 0 and worst_conf <= conf_tolerance
+        ok &= match
+        print(f"  {'OK  ' if match else 'DIFF'} {os.path.basename(image_path)}: {len(expected)} torch / {len(actual)} onnx, "
+              f"{unmatched} missing, {extra} extra, max conf diff {worst_conf:.4f}")
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python onnx_backend.py export <run_name|run_dir|weights.pt> [imgsz]")
+        print("       python onnx_backend.py parity <weights.pt> <model.onnx> <image_dir>")
+        sys.exit(1)
+
+    mode = sys.argv[1]
+    if mode == "export":
+        export_onnx(sys.argv[2], imgsz=int(sys.argv[3]) if len(sys.argv) > 3 else 640)
+    elif mode == "parity" and len(sys.argv) > 4:
+        image_files = sorted(glob.glob(os.path.join(sys.argv[4], "**", "*.jp*g"), recursive=True))[:20]
+        sys.exit(0 if check_parity(sys.argv[2], sys.argv[3], image_files) else 1)
+    else:
+        print(f"Unknown mode: {mode}")
+        sys.exit(1)
@@ -1,21 +1,9 @@
-from image_preproccesing_functions import resolve_enhanced_labels,resolve_enhanced_yaml
+from image_preproccesing_functions import migrate_enhanced_layout, resolve_enhanced_labels, resolve_enhanced_yaml
 
 if __name__ == "__main__":
+    # preprocess_dataset_images already writes to data/enhanced_images/images/<split>; this only
+    # moves outputs of older runs there (safe to rerun), then adds the labels and dataset YAML.
+    migrate_enhanced_layout()
+    print("Enhanced images restructured under 'images/' folder.")
     resolve_enhanced_yaml()
     resolve_enhanced_labels()
-    import os, shutil
-
-    ENHANCED_ROOT = "data/enhanced_images"
-
-    # 1 Move train/val/test folders into an 'images/' subfolder
-    images_folder = os.path.join(ENHANCED_ROOT, "images")
-    os.makedirs(images_folder, exist_ok=True)
-
-    for split in ["train", "val", "test"]:
-        src = os.path.join(ENHANCED_ROOT, split)
-        dst = os.path.join(images_folder, split)
-        if os.path.exists(src):
-            shutil.move(src, dst)
-            print(f"Moved {src} → {dst}")
-
-    print("Enhanced images restructured under 'images/' folder.")
@@ -0,0 +1,408 @@
+import os
+import sys
+import copy
+import json
+import math
+import time
+import queue
+import random
+import hashlib
+import argparse
+import itertools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yaml
+
+from eval_metrics import summarize_results
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPERIMENTS_DIR = os.path.join(BASE_DIR, "experiments")
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+STATE_NAME = "sweep.json"
+RESULTS_NAME = "sweep_results.csv"
+
+# =========================
+# === Search Space ========
+# =========================
+
+def set_path(config, dotted_key, value):
+    """Set config["a"]["b"] for "a.b", creating dicts on the way (e.g. stage_kwargs.enhanced.clip_limit)."""
+    keys = dotted_key.split(".")
+    for key in keys[:-1]:
+        config = config.setdefault(key, {})
+    config[keys[-1]] = value
+
+
+def expand_grid(grid):
+    """{"lr0": [0.01, 0.001], "imgsz": [512, 640]} -> every combination as a dict."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def sample_value(rng, dist):
+    """
+    Draw one value from a search-space entry:
+        [a, b, c]                   one of the listed values
+        {"choice": [...]}           same
+        {"uniform": [low, high]}    float
+        {"loguniform": [low, high]} float, uniform in log space
+        {"int": [low, high]}        integer, both ends included
+    """
+    if isinstance(dist, list):
+        return rng.choice(dist)
+    (kind, arg), = dist.items()
+    if kind == "choice":
+        return rng.choice(arg)
+    if kind == "uniform":
+        return rng.uniform(*arg)
+    if kind == "loguniform":
+        return math.exp(rng.uniform(math.log(arg[0]), math.log(arg[1])))
+    if kind == "int":
+        return rng.randint(*arg)
+    raise ValueError(f"Unknown distribution: {kind}")
+
+
+def sample_random(space, samples, seed=0):
+    rng = random.Random(seed)
+    return [{key: sample_value(rng, space[key]) for key in sorted(space)} for _ in range(samples)]
+
+
+def trial_id(params):
+    """Stable id from the parameter values, so a re-expanded sweep finds its earlier runs."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:8]
+
+
+def expand_sweep(spec):
+    """
+    Turn a sweep spec into a list of trials (id, params, full train.py config).
+
+    Spec keys:
+        base: train.py config shared by every run (mode, epochs, model, ...)
+        grid: {param: [values]} expanded as a full product
+        random: {samples: N, seed: S, params: {param: distribution}}; the same N draws are
+            combined with every grid point
+    Param names may be dotted to reach nested keys, e.g. stage_kwargs.enhanced.clip_limit.
+    """
+    grid_points = expand_grid(spec.get("grid") or {})
+    random_spec = spec.get("random") or {}
+    random_points = sample_random(random_spec.get("params", {}), random_spec.get("samples", 0),
+                                  random_spec.get("seed", 0)) if random_spec else [{}]
+
+    trials = {}
+    for grid_params, random_params in itertools.product(grid_points, random_points or [{}]):
+        params = dict(grid_params, **random_params)
+        config = copy.deepcopy(spec.get("base") or {})
+        for key, value in params.items():
+            set_path(config, key, value)
+        trials.setdefault(trial_id(params), (params, config))
+    return [(tid, params, config) for tid, (params, config) in trials.items()]
+
+
+# =========================
+# === Scheduling ==========
+# =========================
+
+def core_slots(parallel, cores_per_run=None):
+    """Split the CPUs this process may use into `parallel` disjoint sets."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cores_per_run = cores_per_run or max(1, len(cores) // parallel)
+    if cores_per_run * parallel > len(cores):
+        raise ValueError(f"{parallel} runs x {cores_per_run} cores doesn't fit on {len(cores)} cores")
+    return [cores[i * cores_per_run:(i + 1) * cores_per_run] for i in range(parallel)]
+
+
+def limit_process(pid, cores, memory_bytes=None):
+    """
+    Pin a freshly started run to its cores and cap its address space.
+
+    Done from the parent right after the process starts (preexec_fn isn't safe with the
+    scheduler threads); the run is still importing Python at that point, so its torch
+    threads and dataloader workers inherit both.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, cores)
+    if memory_bytes:
+        import resource
+        resource.prlimit(pid, resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+class Sweep:
+    """
+    Runs the trials of one sweep with a fixed number of concurrent train.py processes.
+
+    Every run gets its own disjoint set of cores (torch and OpenMP threads and the
+    dataloader workers all stay on them) and an optional address-space limit. Progress
+    is kept in experiments/<sweep>/sweep.json; starting the same sweep again skips
+    finished runs and resumes interrupted ones from their last.pt.
+    """
+
+    def __init__(self, name, trials, parallel=1, cores_per_run=None, memory_gb=None, retry_failed=False,
+                 results_name=RESULTS_NAME):
+        self.name = name
+        self.trials = trials
+        self.results_name = results_name
+        self.sweep_dir = os.path.join(EXPERIMENTS_DIR, name)
+        self.slots = core_slots(parallel, cores_per_run)
+        self.memory_bytes = int(memory_gb * 1024 ** 3) if memory_gb else None
+        self.retry_failed = retry_failed
+        self.state_path = os.path.join(self.sweep_dir, STATE_NAME)
+        self.executed = []  # run ids trained by this object's run() calls
+        self._lock = threading.Lock()
+        os.makedirs(self.sweep_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def _update(self, run_id, **fields):
+        with self._lock:
+            self.state.setdefault(run_id, {}).update(fields)
+            self._save_state()
+
+    def run_dir(self, run_id):
+        return os.path.join(self.sweep_dir, run_id)
+
+    def pending(self):
+        skip = {"done"} | (set() if self.retry_failed else {"failed"})
+        return [t for t in self.trials if self.state.get(t[0], {}).get("status") not in skip]
+
+    def _run_config(self, run_id, config, cores):
+        config = copy.deepcopy(config)
+        config.setdefault("mode", "normal")
+        config.update(project=self.sweep_dir, name=run_id, exist_ok=True)
+        config.setdefault("threads", len(cores))
+        config.setdefault("workers", max(1, len(cores) // 2))
+        last = os.path.join(self.run_dir(run_id), "weights", "last.pt")
+        if os.path.exists(last):
+            config.update(model=last, resume=True)
+        return config
+
+    def finished(self, run_id, run_config):
+        """True when the run's results.csv already has every epoch the config asks for."""
+        csv_path = os.path.join(self.run_dir(run_id), "results.csv")
+        if not os.path.exists(csv_path):
+            return False
+        try:
+            epochs_done = summarize_results(csv_path)["epochs"]
+        except (ValueError, KeyError, pd.errors.ParserError, pd.errors.EmptyDataError):
+            return False
+        return epochs_done >= int(run_config.get("epochs", 50))
+
+    def _execute(self, trial, slot_queue):
+        run_id, params, config = trial
+        cores = slot_queue.get()
+        try:
+            run_dir = self.run_dir(run_id)
+            os.makedirs(run_dir, exist_ok=True)
+            run_config = self._run_config(run_id, config, cores)
+            config_path = os.path.join(run_dir, "sweep_config.yaml")
+            with open(config_path, "w") as f:
+                yaml.safe_dump(run_config, f, sort_keys=False)
+
+            if self.finished(run_id, run_config):
+                # Trained to the end but not marked done (e.g. the sweep was killed right after);
+                # Ultralytics refuses to resume a finished run, so don't launch it again
+                self._update(run_id, status="done", params=params, returncode=0)
+                print(f"[{self.name}] {run_id} already trained to {run_config.get('epochs', 50)} epochs")
+                return
+
+            env = dict(os.environ, OMP_NUM_THREADS=str(len(cores)), MKL_NUM_THREADS=str(len(cores)))
+            self._update(run_id, status="running", params=params, cores=cores, started=time.time())
+            print(f"[{self.name}] start {run_id} on cores {cores[0]}-{cores[-1]}: {params}")
+            start = time.perf_counter()
+            with open(os.path.join(run_dir, "train.log"), "a") as log:
+                proc = subprocess.Popen([sys.executable, TRAIN_SCRIPT, "--config", config_path],
+                                        stdout=log, stderr=subprocess.STDOUT, env=env)
+                try:
+                    limit_process(proc.pid, cores, self.memory_bytes)
+                except (OSError, ValueError, AttributeError) as e:
+                    print(f"[{self.name}] Warning: could not pin/limit {run_id}: {e}")
+                proc.wait()
+            duration = time.perf_counter() - start
+            status = "done" if proc.returncode == 0 or self.finished(run_id, run_config) else "failed"
+            with self._lock:
+                self.executed.append(run_id)
+            self._update(run_id, status=status, returncode=proc.returncode, duration=duration)
+            print(f"[{self.name}] {status} {run_id} in {duration / 60:.1f} min (exit {proc.returncode})")
+        finally:
+            slot_queue.put(cores)
+
+    def run(self):
+        """Run every pending trial, then write the results table. Returns the table."""
+        todo = self.pending()
+        print(f"[{self.name}] {len(self.trials)} trials, {len(self.trials) - len(todo)} already finished, "
+              f"{len(todo)} to run on {len(self.slots)} slots of {len(self.slots[0])} cores")
+        slot_queue = queue.Queue()
+        for cores in self.slots:
+            slot_queue.put(cores)
+        with ThreadPoolExecutor(max_workers=len(self.slots)) as pool:
+            for future in [pool.submit(self._execute, trial, slot_queue) for trial in todo]:
+                future.result()
+        return self.write_results()
+
+    def write_results(self):
+        """One row per trial: its params, status and best/last epoch metrics from results.csv."""
+        rows = []
+        for run_id, params, _ in self.trials:
+            row = {"run": run_id}
+            row.update(self.state.get(run_id, {"status": "pending"}))
+            row.pop("params", None)
+            row.update({f"param_{k}": v for k, v in params.items()})
+            csv_path = os.path.join(self.run_dir(run_id), "results.csv")
+            if os.path.exists(csv_path):
+                try:
+                    summary = summarize_results(csv_path)
+                    row["epochs_done"] = summary["epochs"]
+                    for which in ("best", "last"):
+                        row.update({f"{which}_{k}": v for k, v in summary[which].items()})
+                except (ValueError, KeyError, pd.errors.ParserError, pd.errors.EmptyDataError):
+                    pass
+            rows.append(row)
+
+        df = pd.DataFrame(rows)
+        if "best_map50_95" in df.columns:
+            df = df.sort_values("best_map50_95", ascending=False, na_position="last")
+        results_path = os.path.join(self.sweep_dir, self.results_name)
+        df.to_csv(results_path, index=False)
+        print(f"[{self.name}] results written to {results_path}")
+        return df
+
+
+# ===============================
+# === Successive Halving ========
+# ===============================
+
+def run_fitness(run_dir):
+    """Best-epoch Ultralytics fitness (0.1 * mAP50 + 0.9 * mAP50-95) from results.csv, or None."""
+    csv_path = os.path.join(run_dir, "results.csv")
+    if not os.path.exists(csv_path):
+        return None
+    try:
+        best = summarize_results(csv_path)["best"]
+    except (ValueError, KeyError, pd.errors.ParserError, pd.errors.EmptyDataError):
+        return None
+    return 0.1 * best["map50"] + 0.9 * best["map50_95"]
+
+
+def successive_halving(name, trials, rungs, keep=1 / 3, warm_start=True, **sweep_kwargs):
+    """
+    Train every trial on a small budget and promote only the best fraction to larger ones.
+
+    Args:
+        name: Sweep name (runs go to experiments/<name>/<trial id>_r<rung>)
+        trials: Output of expand_sweep
+        rungs: Budgets as config overrides, smallest first, e.g.
+            [{"epochs": 5, "imgsz": 320}, {"epochs": 15, "imgsz": 480}, {"epochs": 50}]
+        keep: Fraction of each rung promoted to the next (at least one trial)
+        warm_start: Continue promoted trials from their previous rung's last.pt, training only
+            the extra epochs; otherwise every rung starts from the base weights. A warm-started
+            rung is a new Ultralytics run (fine-tuning), not a resume: its LR schedule starts
+            over for the extra epochs, so it is not equivalent to one run of the full length.
+            Warmup is skipped (warmup_epochs=0) unless the budget or base config sets it.
+        sweep_kwargs: parallel, cores_per_run, memory_gb, retry_failed (see Sweep)
+
+    Returns:
+        DataFrame with every trial's fitness per rung, best first
+    """
+    scores = {tid: {} for tid, _, _ in trials}
+    survivors = list(trials)
+    cpu_seconds = 0.0
+    for r, budget in enumerate(rungs):
+        rung_trials = []
+        for tid, params, config in survivors:
+            config = copy.deepcopy(config)
+            config.update(budget)
+            previous = os.path.join(EXPERIMENTS_DIR, name, f"{tid}_r{r - 1}", "weights", "last.pt")
+            if warm_start and r > 0 and os.path.exists(previous):
+                config["model"] = previous
+                config["epochs"] = max(1, budget.get("epochs", 0) - rungs[r - 1].get("epochs", 0))
+                config.setdefault("warmup_epochs", 0)
+            rung_trials.append((f"{tid}_r{r}", dict(params, rung=r), config))
+
+        print(f"[{name}] rung {r}: {len(rung_trials)} trials with {budget}")
+        sweep = Sweep(name, rung_trials, results_name=f"rung{r}_results.csv", **sweep_kwargs)
+        sweep.run()
+        for (tid, _, _), (run_id, _, _) in zip(survivors, rung_trials):
+            scores[tid][r] = run_fitness(sweep.run_dir(run_id))
+            if run_id in sweep.executed:  # runs finished by an earlier invocation cost nothing now
+                state = sweep.state.get(run_id, {})
+                cpu_seconds += state.get("duration", 0.0) * len(state.get("cores", []))
+
+        if r == len(rungs) - 1:
+            break
+        def rung_score(trial):
+            score = scores[trial[0]][r]
+            return score if score is not None else -1.0
+
+        ranked = sorted(survivors, key=rung_score, reverse=True)
+        n_keep = max(1, math.ceil(len(ranked) * keep))
+        survivors = [t for t in ranked[:n_keep] if scores[t[0]][r] is not None] or ranked[:1]
+        print(f"[{name}] rung {r}: promoting {[t[0] for t in survivors]}")
+
+    params_by_id = {tid: params for tid, params, _ in trials}
+    rows = []
+    for tid, by_rung in scores.items():
+        row = {"trial": tid, "rungs_reached": len(by_rung)}
+        row.update({f"fitness_r{r}": f for r, f in by_rung.items()})
+        row.update({f"param_{k}": v for k, v in params_by_id[tid].items()})
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    sort_cols = [f"fitness_r{r}" for r in reversed(range(len(rungs))) if f"fitness_r{r}" in df.columns]
+    df = df.sort_values(["rungs_reached"] + sort_cols, ascending=False, na_position="last").reset_index(drop=True)
+    results_path = os.path.join(EXPERIMENTS_DIR, name, "halving_results.csv")
+    df.to_csv(results_path, index=False)
+    print(f"[{name}] successive halving done: best trial {df.iloc[0]['trial']}, "
+          f"{cpu_seconds / 3600:.1f} core-hours this invocation; table in {results_path}")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Parallel grid/random hyperparameter sweep over train.py",
+        epilog="With a `halving: {rungs: [...], keep: 0.33, warm_start: true}` section in the spec, "
+               "trials are run as successive halving (see successive_halving).",
+    )
+    parser.add_argument("spec", help="Sweep YAML (base / grid / random / halving, see expand_sweep)")
+    parser.add_argument("--name", help="Sweep name (default: spec file name); runs go to experiments/<name>/")
+    parser.add_argument("--parallel", type=int, default=1, help="Concurrent training runs")
+    parser.add_argument("--cores-per-run", type=int, help="Cores pinned per run (default: all cores / parallel)")
+    parser.add_argument("--memory-gb", type=float, help="Address-space limit per run")
+    parser.add_argument("--retry-failed", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the trials")
+    args = parser.parse_args()
+
+    with open(args.spec, "r") as f:
+        spec = yaml.safe_load(f)
+    name = args.name or spec.get("name") or os.path.splitext(os.path.basename(args.spec))[0]
+    trials = expand_sweep(spec)
+
+    if args.dry_run:
+        for run_id, params, _ in trials:
+            print(f"{run_id}  {params}")
+        print(f"{len(trials)} trials")
+        sys.exit(0)
+
+    sweep_kwargs = {
+        "parallel": args.parallel,
+        "cores_per_run": args.cores_per_run,
+        "memory_gb": args.memory_gb,
+        "retry_failed": args.retry_failed,
+    }
+    halving = spec.get("halving")
+    if halving:
+        successive_halving(name, trials, halving["rungs"], halving.get("keep", 1 / 3),
+                           halving.get("warm_start", True), **sweep_kwargs)
+    else:
+        Sweep(name, trials, **sweep_kwargs).run()
@@ -1,10 +1,15 @@
 import os
-import yaml, glob
-from PIL import Image 
-from ultralytics import YOLO
 import sys
+import time
+import yaml
+import argparse
+from ultralytics import YOLO
 
-model = YOLO('yolov8n.pt')  # nano (smallest/fastest)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from training_data import make_preprocessing_trainer, make_cached_trainer
+import instrumentation
+
+DEFAULT_MODEL = 'yolov8n.pt'  # nano (smallest/fastest)
 # Directory Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_PATH = os.path.join(BASE_DIR, "data", "yolo_dataset", "dataset.yaml")
@@ -15,53 +20,206 @@ os.makedirs(OUTPUTS_DIR, exist_ok=True)
 os.makedirs(METRICS_DIR, exist_ok=True)
 ENHANCED_DIR = os.path.join(BASE_DIR, "data", "enhanced_images")
 ENHANCED_YAML = os.path.join(BASE_DIR, "data", "enhanced_images", "dataset_enhanced.yaml")
+IMAGE_CACHE_DIR = os.path.join(BASE_DIR, "data", "image_cache")
+
+# Ultralytics train() arguments per mode; anything here can be overridden by the config/CLI
+MODE_DEFAULTS = {
+    "normal": {
+        "data": DATA_PATH,
+        "imgsz": 640,
+        "name": "baseline",
+        "project": OUTPUTS_DIR,  # YOLO saves directly here
+    },
+    "enhanced": {
+        "data": DATA_PATH,
+        "imgsz": 640,
+        "batch": 16,
+        "device": "cpu",
+        "project": OUTPUTS_DIR,
+        "name": "enhanced_exp1",
+        "augment": True,
+        "lr0": 0.01,
+        "momentum": 0.937,
+        "weight_decay": 0.0005,
+    },
+}
+MODE_DEFAULTS["enhanced_offline"] = dict(MODE_DEFAULTS["enhanced"], data=ENHANCED_YAML)
+
+# Config keys handled by this launcher rather than passed on to Ultralytics
+LAUNCHER_KEYS = ("mode", "model", "threads", "autotune", "enhance_output", "stage_kwargs", "enhance_cache_size",
+                 "image_cache", "image_cache_ram", "image_cache_max_bytes")
+
+_models = {}
+
+def get_model(weights=DEFAULT_MODEL):
+    """Load the YOLO weights on first use, so importing train.py doesn't load a model."""
+    if weights not in _models:
+        with instrumentation.timer("train.model_load"):
+            _models[weights] = YOLO(weights)
+    return _models[weights]
+
+def add_step_timers(model):
+    """
+    Time every optimizer step ("train.step": forward, backward, update) and the wait for
+    the next batch in between ("train.data_wait") through Ultralytics callbacks.
+    """
+    state = {}
+
+    def on_epoch_start(trainer):
+        state.pop("end", None)
+
+    def on_batch_start(trainer):
+        now = time.perf_counter()
+        if "end" in state:
+            instrumentation.observe("train.data_wait", now - state["end"])
+        state["start"] = now
+
+    def on_batch_end(trainer):
+        now = time.perf_counter()
+        instrumentation.observe("train.step", now - state["start"])
+        instrumentation.count("train.images", trainer.batch_size)
+        state["end"] = now
+
+    model.add_callback("on_train_epoch_start", on_epoch_start)
+    model.add_callback("on_train_batch_start", on_batch_start)
+    model.add_callback("on_train_batch_end", on_batch_end)
 
 # Train
 
-def normal_train(epochs: int):
-    results = model.train(
-        data=DATA_PATH,
-        epochs=epochs,
-        imgsz=640,
-        name="baseline",
-        project=OUTPUTS_DIR  # YOLO saves directly here
-    )
-    return results
-
-def enhanced_train(epochs: int):
-    # Prepare enhanced images if not already done
-    # if not os.path.exists(ENHANCED_YAML):
-    #     preprocess_dataset_images(DATA_PATH)
-    #     resolve_enhanced_labels()
-    #     resolve_enhanced_yaml()
-
-    results = model.train(
-        data=ENHANCED_YAML,
-        epochs=epochs,
-        imgsz=640,
-        batch=16,
-        device='cpu',
-        project=OUTPUTS_DIR,
-        name='enhanced_exp1',
-        augment=True,
-        lr0=0.01,
-        momentum=0.937,
-        weight_decay=0.0005
-    )
-    return results
+def train(config):
+    """
+    Train from a config dict (e.g. a YAML file loaded with load_config).
+
+    Launcher keys:
+        mode: normal | enhanced | enhanced_offline (picks the defaults in MODE_DEFAULTS)
+        model: Weights to start from (default yolov8n.pt)
+        threads: torch intra-op threads
+        autotune: Probe batch/workers/threads first (autotune.py) and use the fastest
+        enhance_output, stage_kwargs, enhance_cache_size: on-the-fly preprocessing (enhanced mode)
+        image_cache, image_cache_ram, image_cache_max_bytes: decoded-image cache
+    Every other key is an Ultralytics train() argument (epochs, batch, imgsz, workers, ...).
+    """
+    config = dict(config)
+    mode = config.get("mode", "normal")
+    if mode not in MODE_DEFAULTS:
+        raise ValueError(f"Unknown mode: {mode}")
+    weights = config.get("model") or DEFAULT_MODEL
+    train_args = dict(MODE_DEFAULTS[mode])
+    train_args.update({k: v for k, v in config.items() if k not in LAUNCHER_KEYS})
+
+    threads = config.get("threads")
+    if config.get("autotune"):
+        from autotune import autotune
+        print(f"Autotuning batch size, workers and threads for {mode} training...")
+        tuned = autotune(weights, train_args["data"], train_args.get("imgsz", 640), enhance=mode == "enhanced")
+        if tuned["images_per_sec"] > 0:
+            train_args.update(batch=tuned["batch"], workers=tuned["workers"])
+            threads = tuned["threads"]
+    if threads:
+        import torch
+        torch.set_num_threads(int(threads))
+
+    cache_kwargs = {
+        "image_cache_dir": IMAGE_CACHE_DIR if config.get("image_cache") else None,
+        "image_cache_ram": int(config.get("image_cache_ram") or 0),
+        "image_cache_max_bytes": config.get("image_cache_max_bytes"),
+    }
+    if mode == "enhanced":
+        train_args["trainer"] = make_preprocessing_trainer(
+            enhance_output=config.get("enhance_output", "enhanced"),
+            stage_kwargs=config.get("stage_kwargs"),
+            enhance_cache_size=int(config.get("enhance_cache_size") or 0),
+            **cache_kwargs
+        )
+    elif cache_kwargs["image_cache_dir"]:
+        train_args["trainer"] = make_cached_trainer(**cache_kwargs)
+
+    model = get_model(weights)
+    if instrumentation.enabled():
+        add_step_timers(model)
+    with instrumentation.timer("train.total"):
+        return model.train(**train_args)
+
+def normal_train(epochs: int, image_cache=False, image_cache_ram=0):
+    """
+    Baseline training. With image_cache, decoded and resized frames are kept in
+    data/image_cache (image_cache_ram bytes of it in RAM) and reused across epochs and runs.
+    """
+    return train({"mode": "normal", "epochs": epochs, "image_cache": image_cache, "image_cache_ram": image_cache_ram})
+
+def enhanced_train(epochs: int, on_the_fly=True, enhance_cache_size=0, image_cache=False, image_cache_ram=0):
+    """
+    Train on CLAHE-enhanced images.
+
+    By default frames are enhanced inside the dataloader, straight from the normal
+    YOLO dataset. With on_the_fly=False the pre-built copy in data/enhanced_images
+    (preprocess_dataset_images + patch_enhanced_folder.py) is used instead. The two are
+    not interchangeable: on the fly, frames are enhanced after resizing to imgsz, while
+    the offline copy is enhanced at full resolution.
+    With image_cache, decoded (and, on the fly, already enhanced) frames are kept in
+    data/image_cache so only the first epoch of the first run decodes JPEGs.
+    """
+    return train({
+        "mode": "enhanced" if on_the_fly else "enhanced_offline",
+        "epochs": epochs,
+        "enhance_cache_size": enhance_cache_size,
+        "image_cache": image_cache,
+        "image_cache_ram": image_cache_ram,
+    })
+
+def load_config(config_file):
+    with open(config_file, "r") as f:
+        return yaml.safe_load(f) or {}
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python train.py <normal|enhanced> [epochs]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Train YOLO on the PCB dataset",
+        epilog="Settings are merged as: mode defaults < --config file < command line. "
+               "Set PCB_METRICS=<dir> to record stage timings (see utils/instrumentation.py).",
+    )
+    parser.add_argument("mode", nargs="?", choices=sorted(MODE_DEFAULTS))
+    parser.add_argument("epochs", nargs="?", type=int)
+    parser.add_argument("enhance_cache_size", nargs="?", type=int)
+    parser.add_argument("--config", help="YAML with launcher keys and/or Ultralytics train() arguments")
+    parser.add_argument("--model", help=f"Starting weights (default {DEFAULT_MODEL})")
+    parser.add_argument("--imgsz", type=int)
+    parser.add_argument("--batch", type=int)
+    parser.add_argument("--workers", type=int, help="Dataloader workers")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--device")
+    parser.add_argument("--name", help="Run name under the project directory")
+    parser.add_argument("--image-cache", nargs="?", type=float, const=0.0, metavar="GIB_IN_RAM",
+                        help="Use the decoded-image cache, optionally keeping GIB_IN_RAM of it in RAM")
+    parser.add_argument("--autotune", action="store_true", help="Probe batch/workers/threads before training")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Any other train() argument, e.g. --set lr0=0.005 (repeatable)")
+    args = parser.parse_args()
 
-    mode = sys.argv[1]
-    epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    config = load_config(args.config) if args.config else {}
+    cli = {
+        "mode": args.mode,
+        "epochs": args.epochs,
+        "enhance_cache_size": args.enhance_cache_size,
+        "model": args.model,
+        "imgsz": args.imgsz,
+        "batch": args.batch,
+        "workers": args.workers,
+        "threads": args.threads,
+        "device": args.device,
+        "name": args.name,
+    }
+    config.update({k: v for k, v in cli.items() if v is not None})
+    if args.image_cache is not None:
+        config.update(image_cache=True, image_cache_ram=int(args.image_cache * 1024 ** 3))
+    if args.autotune:
+        config["autotune"] = True
+    for item in args.set:
+        key, _, value = item.partition("=")
+        config[key] = yaml.safe_load(value)
 
-    if mode == "normal":
-        normal_train(epochs)
-    elif mode == "enhanced":
-        enhanced_train(epochs)
-    else:
-        print(f"Unknown mode: {mode}")
-        sys.exit(1)
\ No newline at end of file
+    if "mode" not in config:
+        parser.print_usage()
+        print("A mode is required (positional or `mode:` in --config)")
+        sys.exit(1)
+    config.setdefault("epochs", 50)
+    train(config)
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+from collections import OrderedDict
+
+import cv2
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from image_preproccesing_functions import get_engine
+from image_cache import ImageCache, cache_key
+from instrumentation import timer, count
+
+# ==========================================
+# === Decoded-image Cache Dataset ==========
+# ==========================================
+
+class CachedYOLODataset(YOLODataset):
+    """
+    YOLODataset that reads decoded, resized frames from a persistent ImageCache.
+
+    The cache is built (or brought up to date) once when the dataset is created and
+    lives under image_cache_dir/<key>, where the key covers the image source, imgsz,
+    resize interpolation and cache_variant(); later runs and epochs only slice frames
+    out of memory-mapped shards instead of decoding JPEGs. Frames missing from the
+    cache (budget reached, unreadable) are loaded the normal way.
+
+    Args:
+        image_cache_dir: Root directory for cache shards (None disables the cache)
+        image_cache_ram: Bytes of shards to hold in RAM, the rest stays memory-mapped
+        image_cache_max_bytes: Disk budget for one cache (None = unlimited)
+        image_cache_workers: Decode threads used while building
+    """
+
+    def __init__(self, *args, image_cache_dir=None, image_cache_ram=0, image_cache_max_bytes=None,
+                 image_cache_workers=8, **kwargs):
+        self.image_cache = None
+        super().__init__(*args, **kwargs)
+        if image_cache_dir:
+            # BaseDataset.load_image resizes with INTER_LINEAR in train and val alike
+            interpolation = cv2.INTER_LINEAR
+            variant = self.cache_variant()
+            key = cache_key(self.img_path, self.imgsz, interpolation, variant)
+            self.image_cache = ImageCache(
+                os.path.join(image_cache_dir, key),
+                self.imgsz,
+                interpolation=interpolation,
+                variant=variant,
+                ram_bytes=image_cache_ram,
+                max_bytes=image_cache_max_bytes,
+            )
+            self.image_cache.update(self.im_files, self.prepare_frame, image_cache_workers)
+
+    def cache_variant(self):
+        """What prepare_frame does to frames; part of the cache key."""
+        return "raw"
+
+    def prepare_frame(self, im):
+        """Applied to every resized frame before it is cached."""
+        return im
+
+    def load_image(self, i, rect_mode=True):
+        if self.image_cache is not None and rect_mode:
+            if self.ims[i] is not None:
+                return self.ims[i], self.im_hw0[i], self.im_hw[i]
+            with timer("train.cache_read"):
+                cached = self.image_cache.get(self.im_files[i])
+            if cached is not None:
+                count("train.cache_hits")
+                self._buffer_frame(i, *cached)
+                return cached
+            count("train.cache_misses")
+        with timer("train.load_image"):
+            return self.load_uncached(i, rect_mode)
+
+    def _buffer_frame(self, i, im, hw0, hw):
+        """
+        Same bookkeeping as BaseDataset.load_image for a decoded frame: in augment mode
+        the frame joins self.buffer, which Mosaic/MixUp sample their extra images from.
+        """
+        if not self.augment:
+            return
+        self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, hw
+        self.buffer.append(i)
+        if 1 < len(self.buffer) >= self.max_buffer_length:
+            j = self.buffer.pop(0)
+            if self.cache != "ram":
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+
+    def load_uncached(self, i, rect_mode=True):
+        return super().load_image(i, rect_mode)
+
+
+# ==========================================
+# === On-the-fly Preprocessing Dataset =====
+# ==========================================
+
+class PreprocessingYOLODataset(CachedYOLODataset):
+    """
+    YOLODataset that runs the CLAHE/denoise pipeline on every frame as it is loaded.
+
+    Frames are enhanced after Ultralytics has decoded and resized them, so no enhanced
+    copy of the dataset is needed on disk. Enhanced frames can be kept in a small LRU
+    so images that come up again (mosaic, later epochs) are not enhanced twice, or,
+    with image_cache_dir, in the persistent decoded-image cache, which then holds
+    frames that are already enhanced.
+
+    Because enhancement runs on the frame after it was resized to imgsz, CLAHE tiles and
+    denoising see fewer pixels than in the offline pipeline, which enhances the images
+    at full resolution (enhanced_images/). Models trained on the fly are therefore not
+    fed exactly the same frames as models trained on the offline enhanced folder.
+
+    Args:
+        enhance_output: Pipeline stage fed to the model ("enhanced" or "denoised")
+        stage_kwargs: Extra keyword arguments per pipeline stage (see run_pipeline)
+        enhance_cache_size: Number of enhanced frames kept in RAM (0 disables the LRU)
+    """
+
+    def __init__(self, *args, enhance_output="enhanced", stage_kwargs=None, enhance_cache_size=0, **kwargs):
+        # Set before super().__init__, which may already load images when cache="ram"
+        self.enhance_output = enhance_output
+        self.stage_kwargs = stage_kwargs
+        self.enhance_cache_size = enhance_cache_size
+        self._enhance_cache = OrderedDict()
+        # Indices whose self.ims entry, when set, is already enhanced. A plain set pickles,
+        # so spawned DataLoader workers receive it together with the cache="ram" frames.
+        self._enhanced_ims = set()
+        super().__init__(*args, **kwargs)
+
+    def cache_variant(self):
+        return f"{self.enhance_output}:{json.dumps(self.stage_kwargs, sort_keys=True)}"
+
+    def prepare_frame(self, im):
+        with timer("train.enhance"):
+            # The engine returns its reused buffer; the dataset keeps and augments the frame, so copy it out
+            return get_engine(self.stage_kwargs).run(im, (self.enhance_output,))[self.enhance_output].copy()
+
+    def load_uncached(self, i, rect_mode=True):
+        cached = self._enhance_cache.get(i)
+        if cached is not None:
+            self._enhance_cache.move_to_end(i)
+            return cached
+
+        # Ultralytics hands back its own buffered/RAM-cached frame when it has one;
+        # that frame is the one we enhanced and stored there earlier.
+        if self.ims[i] is not None and i in self._enhanced_ims:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im, hw0, hw = super().load_uncached(i, rect_mode)
+        enhanced = self.prepare_frame(im)
+        if self.ims[i] is im:
+            self.ims[i] = enhanced
+        # cache_images stores the returned frame itself, so the flag holds there too
+        self._enhanced_ims.add(i)
+
+        if self.enhance_cache_size > 0:
+            self._enhance_cache[i] = (enhanced, hw0, hw)
+            if len(self._enhance_cache) > self.enhance_cache_size:
+                self._enhance_cache.popitem(last=False)
+        return enhanced, hw0, hw
+
+
+def build_preprocessing_dataset(cfg, img_path, batch, data, mode="train", rect=False, stride=32,
+                                dataset_cls=None, **dataset_kwargs):
+    """Same as ultralytics.data.build_yolo_dataset, but builds a PreprocessingYOLODataset (or dataset_cls)."""
+    return (dataset_cls or PreprocessingYOLODataset)(
+        img_path=img_path,
+        imgsz=cfg.imgsz,
+        batch_size=batch,
+        augment=mode == "train",
+        hyp=cfg,
+        rect=cfg.rect or rect,
+        cache=cfg.cache or None,
+        single_cls=cfg.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == "train" else 0.5,
+        prefix=colorstr(f"{mode}: "),
+        task=cfg.task,
+        classes=cfg.classes,
+        data=data,
+        fraction=cfg.fraction if mode == "train" else 1.0,
+        **dataset_kwargs,
+    )
+
+
+def _make_trainer(dataset_cls, dataset_kwargs):
+    class PreprocessingDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            model = getattr(self.model, "module", self.model)  # unwrap DDP
+            gs = max(int(model.stride.max() if model else 0), 32)
+            return build_preprocessing_dataset(
+                self.args, img_path, batch, self.data, mode=mode, rect=mode == "val", stride=gs,
+                dataset_cls=dataset_cls, **dataset_kwargs
+            )
+
+    return PreprocessingDetectionTrainer
+
+
+def make_preprocessing_trainer(enhance_output="enhanced", stage_kwargs=None, enhance_cache_size=0,
+                               image_cache_dir=None, image_cache_ram=0, image_cache_max_bytes=None):
+    """
+    Build a DetectionTrainer class whose train/val datasets preprocess frames on the fly.
+
+    With image_cache_dir, enhanced frames are also stored in the persistent decoded-image
+    cache, so only the first run on a dataset pays for decoding and enhancement.
+
+    Usage:
+        model.train(trainer=make_preprocessing_trainer(enhance_cache_size=512), data=...)
+    """
+    return _make_trainer(PreprocessingYOLODataset, {
+        "enhance_output": enhance_output,
+        "stage_kwargs": stage_kwargs,
+        "enhance_cache_size": enhance_cache_size,
+        "image_cache_dir": image_cache_dir,
+        "image_cache_ram": image_cache_ram,
+        "image_cache_max_bytes": image_cache_max_bytes,
+    })
+
+
+def make_cached_trainer(image_cache_dir, image_cache_ram=0, image_cache_max_bytes=None):
+    """
+    Build a DetectionTrainer class that reads plain frames from the persistent decoded-image cache.
+
+    Usage:
+        model.train(trainer=make_cached_trainer("data/image_cache"), data=...)
+    """
+    return _make_trainer(CachedYOLODataset, {
+        "image_cache_dir": image_cache_dir,
+        "image_cache_ram": image_cache_ram,
+        "image_cache_max_bytes": image_cache_max_bytes,
+    })
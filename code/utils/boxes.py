@@ -0,0 +1,57 @@
+# Vectorised bounding box helpers (boxes are x1, y1, x2, y2 in pixels)
+
+# Libraries
+import numpy as np
+
+
+def box_area(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def box_iou(boxes1, boxes2):
+    """
+    Pairwise IoU between two sets of boxes.
+    
+    Args:
+        boxes1: Array of shape (n, 4)
+        boxes2: Array of shape (m, 4)
+    
+    Returns:
+        Array of shape (n, m)
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = box_area(boxes1)[:, None] + box_area(boxes2)[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+
+def nms(boxes, scores, classes=None, iou_threshold=0.5):
+    """
+    Greedy non-maximum suppression, per class when `classes` is given.
+    
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    if classes is not None:
+        # Offset each class far apart so boxes of different classes never overlap
+        offsets = np.asarray(classes, dtype=np.float64)[:, None] * (boxes.max() + 1)
+        boxes = boxes + offsets
+    
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        ious = box_iou(boxes[i:i + 1], boxes[order[1:]])[0]
+        order = order[1:][ious <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
@@ -0,0 +1,81 @@
+# File materialisation helpers shared by the dataset-building scripts
+
+# Libraries
+import os
+import shutil
+
+LINK_MODES = ('copy', 'hardlink', 'symlink', 'reflink', 'auto')
+
+# Linux ioctl that clones a file's extents (btrfs, xfs, ...): _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    import fcntl  # not available on Windows
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def is_materialized(src, dst):
+    """
+    True when `dst` already holds `src` as placed by materialize_file: the same file
+    (hard link, or a symlink to it), or a copy/reflink with the same size and mtime.
+    """
+    try:
+        if os.path.samefile(src, dst):
+            return True
+        s, d = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return not os.path.islink(dst) and s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns
+
+
+def materialize_file(src, dst, mode='copy'):
+    """
+    Place `src` at `dst` using the requested strategy, falling back to a copy.
+
+    Modes:
+        copy: shutil.copy2
+        hardlink: os.link (same filesystem only)
+        symlink: absolute symlink to the source
+        reflink: copy-on-write clone (btrfs/xfs on Linux)
+        auto: reflink, then hardlink, then copy
+
+    Args:
+        src: Existing source file
+        dst: Destination path (replaced if it exists)
+        mode: One of LINK_MODES
+
+    Returns:
+        The mode that was actually used
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Invalid mode '{mode}'. Choose from: {', '.join(LINK_MODES)}.")
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    attempts = ['reflink', 'hardlink'] if mode == 'auto' else [mode]
+    for attempt in attempts:
+        try:
+            if attempt == 'hardlink':
+                os.link(src, dst)
+            elif attempt == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            elif attempt == 'reflink':
+                _reflink(src, dst)
+            else:
+                break
+            return attempt
+        except (OSError, ImportError):
+            continue
+
+    shutil.copy2(src, dst)
+    return 'copy'
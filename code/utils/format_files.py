@@ -1,16 +1,133 @@
 # Txt to Csv Parsers for the annotations and images
 
 # Libraries
-import csv
+import json
 import os
+import struct
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 from PIL import Image
 
+from instrumentation import timer, timed
+
 
 
 
 # Functions
 
+# JPEG start-of-frame markers that carry the image dimensions (not DHT/JPG/DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _jpeg_size(f):
+    f.seek(2)  # past SOI
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':  # fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # markers without a length field
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if length < 2:  # the length counts its own two bytes; anything less is corrupt
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack('>HH', header[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+@timed("format.read_image_size")
+def read_image_size(image_file):
+    """
+    Get (width, height) of an image by reading only its header.
+    
+    JPEG and PNG headers are parsed directly; anything else falls back to PIL,
+    which also only reads the header until pixel data is requested.
+    
+    Returns:
+        Tuple (width, height)
+    """
+    with open(image_file, 'rb') as f:
+        head = f.read(24)
+        size = None
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b'IHDR':
+            size = struct.unpack('>II', head[16:24])
+        elif head[:2] == b'\xff\xd8':
+            size = _jpeg_size(f)
+    if size is not None:
+        return size
+    
+    with Image.open(image_file) as im:
+        return im.size
+
+
+def probe_image_sizes(image_files, cache_file=None, workers=8):
+    """
+    Get the size of many images, reusing a sidecar cache keyed by path and mtime.
+    
+    Args:
+        image_files: Iterable of image paths
+        cache_file: Optional JSON file storing {path: [mtime_ns, width, height]}
+        workers: Threads used to read headers of uncached images
+    
+    Returns:
+        Dict path (str) -> (width, height), or -> None for images that could not be read
+    """
+    cache = {}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable size cache {cache_file}: {e}")
+    
+    def probe(path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            cached = cache.get(path)
+            if cached and cached[0] == mtime:
+                return path, mtime, (cached[1], cached[2]), False
+            return path, mtime, tuple(read_image_size(path)), True
+        except Exception as e:
+            print(f"Warning: Could not read size of {path}: {e}")
+            return path, None, None, False
+    
+    paths = [str(p) for p in image_files]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        probed = list(pool.map(probe, paths))
+    
+    sizes = {}
+    changed = False
+    for path, mtime, size, fresh in probed:
+        sizes[path] = size
+        if fresh:
+            cache[path] = [mtime, size[0], size[1]]
+            changed = True
+    
+    if cache_file and changed:
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+    
+    return sizes
+
+
+@timed("format.parse_yolo_txt")
 def parse_yolo_txt(txt_file, img_width, img_height, class_names=None):
     """
     Parse a YOLO format txt file.
@@ -66,7 +183,109 @@ def parse_yolo_txt(txt_file, img_width, img_height, class_names=None):
     return data
 
 
-def parse_yolo_directory(directory,images_dir, class_names=None, output_csv='output.csv'):
+ANNOTATION_COLUMNS = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax']
+
+
+@timed("format.read_label_array")
+def read_yolo_label_array(txt_file, ncols=5):
+    """
+    Load a YOLO txt file into a float64 array in one go.
+    
+    Args:
+        txt_file: Path to YOLO txt file
+        ncols: Values per line (5 for labels, 6 for predictions with a confidence),
+            or None to take it from the first line
+    
+    Returns:
+        Array of shape (n_boxes, ncols)
+    """
+    with open(txt_file, 'r') as f:
+        text = f.read()
+    
+    if ncols is None:
+        first = next((line for line in text.splitlines() if line.strip()), '')
+        ncols = len(first.split()) or 5
+    
+    values = np.array(text.split(), dtype=np.float64)
+    if values.size % ncols:
+        raise ValueError(f"{txt_file}: expected {ncols} values per line")
+    return values.reshape(-1, ncols)
+
+
+def yolo_to_corners(boxes, img_width, img_height):
+    """
+    Convert normalized (x_center, y_center, width, height) boxes to pixel corners.
+    
+    Matches parse_yolo_txt, including int() truncation toward zero.
+    
+    Args:
+        boxes: Array of shape (n, 4)
+        img_width, img_height: Scalars or arrays of shape (n,)
+    
+    Returns:
+        int64 array of shape (n, 4): xmin, ymin, xmax, ymax
+    """
+    x_center, y_center, width, height = boxes.T
+    corners = np.stack([
+        (x_center - width / 2) * img_width,
+        (y_center - height / 2) * img_height,
+        (x_center + width / 2) * img_width,
+        (y_center + height / 2) * img_height,
+    ], axis=1)
+    return np.trunc(corners).astype(np.int64)
+
+
+@timed("format.parse_yolo_files")
+def parse_yolo_files(pairs, sizes, class_names=None):
+    """
+    Parse many YOLO txt files into one columnar annotation table.
+    
+    Args:
+        pairs: List of (txt_file, image_file) tuples
+        sizes: Dict image_file -> (width, height) or None (see probe_image_sizes);
+            files whose image size is unknown are skipped
+        class_names: Optional dict mapping class_id to class name
+    
+    Returns:
+        DataFrame with ANNOTATION_COLUMNS, one row per box
+    """
+    blocks, filenames, widths, heights = [], [], [], []
+    for txt_file, image_file in pairs:
+        size = sizes.get(image_file)
+        if size is None:
+            continue
+        block = read_yolo_label_array(txt_file)
+        blocks.append(block)
+        filenames.append(Path(txt_file).stem)
+        widths.append(size[0])
+        heights.append(size[1])
+    
+    counts = np.array([len(b) for b in blocks], dtype=np.int64)
+    rows = np.concatenate(blocks) if blocks else np.empty((0, 5))
+    width = np.repeat(np.array(widths, dtype=np.int64), counts)
+    height = np.repeat(np.array(heights, dtype=np.int64), counts)
+    
+    class_ids = rows[:, 0].astype(np.int64)
+    unique_ids, inverse = np.unique(class_ids, return_inverse=True)
+    lookup = np.array(
+        [class_names.get(int(i), str(i)) if class_names else str(i) for i in unique_ids], dtype=object
+    )
+    corners = yolo_to_corners(rows[:, 1:5], width, height)
+    
+    return pd.DataFrame({
+        'filename': np.repeat(np.array(filenames, dtype=object), counts),
+        'width': width,
+        'height': height,
+        'class': lookup[inverse],
+        'xmin': corners[:, 0],
+        'ymin': corners[:, 1],
+        'xmax': corners[:, 2],
+        'ymax': corners[:, 3],
+    }, columns=ANNOTATION_COLUMNS)
+
+
+def parse_yolo_directory(directory,images_dir, class_names=None, output_csv='output.csv',
+                         size_cache=None, workers=8):
     """
     Parse all YOLO txt files in a directory and save to CSV.
     
@@ -74,35 +293,46 @@ def parse_yolo_directory(directory,images_dir, class_names=None, output_csv='out
         directory: Path to directory containing YOLO txt files
         images_dir: Path to directory containing corresponding images
         class_names: Optional dict mapping class_id to class name
-        output_csv: Output CSV file path
+        output_csv: Output CSV file path (.parquet writes Parquet instead)
+        size_cache: Optional sidecar JSON caching image sizes by path and mtime
+            (default: image_sizes.json next to output_csv)
+        workers: Threads used to read image headers
+    
+    Returns:
+        DataFrame of the saved annotations
     """
-    all_data = []
+    if size_cache is None:
+        size_cache = os.path.join(os.path.dirname(output_csv), 'image_sizes.json')
+    
+    pairs = []
     for folder in Path(directory).iterdir(): 
         for txt_file in Path(folder).glob('*.txt'):
             class_folder = folder.name
             image_filename = Path(images_dir) / class_folder / txt_file.with_suffix('.jpg').name
-
-            try:
-                im = Image.open(image_filename)
-                w, h = im.size
-            except Exception as e:
-                print(f"Warning: Could not open {image_filename}: {e}")
-                continue            
-                
-            data = parse_yolo_txt(txt_file, w, h, class_names)
-            all_data.extend(data)
-    
-    # Write to CSV
-    if all_data:
-        fieldnames = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax']
-        with open(output_csv, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(all_data)
+            pairs.append((txt_file, str(image_filename)))
+    
+    with timer("format.probe_image_sizes"):
+        sizes = probe_image_sizes([image_filename for _, image_filename in pairs], size_cache, workers)
+    
+    df = parse_yolo_files(pairs, sizes, class_names)
+    
+    # Write to CSV (or Parquet when output_csv ends with .parquet)
+    if len(df):
+        with timer("format.write_table"):
+            if str(output_csv).endswith('.parquet'):
+                try:
+                    df.to_parquet(output_csv, index=False)
+                except ImportError as e:
+                    raise ImportError(f"Writing {output_csv} needs pyarrow (pip install pyarrow), "
+                                      f"or use a .csv output path") from e
+            else:
+                df.to_csv(output_csv, index=False)
         
-        print(f"Saved {len(all_data)} annotations to {output_csv}")
+        print(f"Saved {len(df)} annotations to {output_csv}")
     else:
         print("No data found")
+    
+    return df
 
 
 
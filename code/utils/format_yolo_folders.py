@@ -1,7 +1,163 @@
+import os
+import sys
+import cv2
+import numpy as np
 import pandas as pd
-import shutil
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from file_ops import LINK_MODES, materialize_file, is_materialized
+from tiling import tile_windows
+from instrumentation import timer, timed, count
+
+IMAGE_EXTENSIONS = ['.jpg', '.png', '.jpeg', '.JPG', '.PNG', '.JPEG']
+
+
+def build_image_index(images_dir, extensions=IMAGE_EXTENSIONS):
+    """
+    Scan the category folders once and map each image stem to its path.
+
+    When the same stem exists more than once (another category folder or another
+    extension), the first one in category-folder order, then `extensions` order, wins.
+
+    Args:
+        images_dir: Path to Images directory with category subfolders
+        extensions: Accepted image extensions, in order of preference
+
+    Returns:
+        Tuple (dict stem -> Path, dict stem -> list of all Paths for duplicated stems)
+    """
+    rank = {ext: i for i, ext in enumerate(extensions)}
+    candidates = defaultdict(list)
+
+    for folder_rank, category_folder in enumerate(Path(images_dir).iterdir()):
+        if not category_folder.is_dir():
+            continue
+        with os.scandir(category_folder) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext in rank and entry.is_file():
+                    candidates[stem].append((folder_rank, rank[ext], Path(entry.path)))
+
+    index = {}
+    duplicates = {}
+    for stem, paths in candidates.items():
+        paths.sort(key=lambda x: (x[0], x[1]))
+        index[stem] = paths[0][2]
+        if len(paths) > 1:
+            duplicates[stem] = [p for _, _, p in paths]
+
+    return index, duplicates
+
+# YOLO format: class_id x_center y_center width height
+YOLO_LINE_FORMAT = "%d %.6f %.6f %.6f %.6f\n"
+
+
+def corners_to_yolo(df, class_mapping):
+    """
+    Convert corner boxes to normalized YOLO rows for a whole annotation DataFrame at once.
+    
+    Args:
+        df: DataFrame with class, width, height, xmin, ymin, xmax, ymax columns
+        class_mapping: Dict mapping class names to class IDs
+    
+    Returns:
+        float64 array of shape (len(df), 5): class_id, x_center, y_center, width, height
+    """
+    class_ids = df['class'].map(class_mapping)
+    if class_ids.isna().any():
+        unknown = sorted(df.loc[class_ids.isna(), 'class'].astype(str).unique())
+        raise KeyError(f"Classes missing from class_mapping: {unknown}")
+    
+    width = df['width'].to_numpy(dtype=np.float64)
+    height = df['height'].to_numpy(dtype=np.float64)
+    xmin, ymin, xmax, ymax = (df[col].to_numpy(dtype=np.float64) for col in ('xmin', 'ymin', 'xmax', 'ymax'))
+    
+    rows = np.empty((len(df), 5), dtype=np.float64)
+    rows[:, 0] = class_ids.to_numpy(dtype=np.float64)
+    rows[:, 1] = ((xmin + xmax) / 2) / width
+    rows[:, 2] = ((ymin + ymax) / 2) / height
+    rows[:, 3] = (xmax - xmin) / width
+    rows[:, 4] = (ymax - ymin) / height
+    return rows
+
+
+@timed("format.write_labels")
+def write_yolo_labels(df, class_mapping, label_dir, write_workers=0, only_changed=False):
+    """
+    Write one YOLO label file per filename in `df`, one buffered write per file.
+    
+    Rows keep their CSV order inside each file.
+    
+    Args:
+        df: Annotation DataFrame (see corners_to_yolo) with a filename column
+        class_mapping: Dict mapping class names to class IDs
+        label_dir: Output directory for the .txt files
+        write_workers: Threads used for writing (0 = write in this thread)
+        only_changed: Leave label files that already have the right content untouched
+    
+    Returns:
+        Dict filename -> number of annotations written
+    """
+    if len(df) == 0:
+        return {}
+    
+    rows = corners_to_yolo(df, class_mapping)
+    filenames = df['filename'].astype(str).to_numpy()
+    order = np.argsort(filenames, kind='stable')
+    filenames, rows = filenames[order], rows[order]
+    names, starts = np.unique(filenames, return_index=True)
+    ends = np.append(starts[1:], len(filenames))
+    
+    def write_one(i):
+        block = rows[starts[i]:ends[i]]
+        text = (YOLO_LINE_FORMAT * len(block)) % tuple(block.ravel().tolist())
+        label_file = Path(label_dir) / f"{names[i]}.txt"
+        if only_changed and label_file.is_file() and label_file.read_text() == text:
+            return
+        with open(label_file, 'w') as f:
+            f.write(text)
+    
+    if write_workers > 0:
+        with ThreadPoolExecutor(max_workers=write_workers) as pool:
+            list(pool.map(write_one, range(len(names))))
+    else:
+        for i in range(len(names)):
+            write_one(i)
+    
+    return {name: int(end - start) for name, start, end in zip(names, starts, ends)}
+
+
+def auto_class_mapping(csv_files):
+    """Map every class name found in the CSVs to an ID, in sorted name order."""
+    all_classes = set()
+    for csv_file in csv_files:
+        df = pd.read_csv(csv_file)
+        all_classes.update(df['class'].unique())
+    return {cls: idx for idx, cls in enumerate(sorted(all_classes))}
+
+
+def write_dataset_yaml(output_path, class_mapping):
+    """Write dataset.yaml for a YOLO folder structure and return its path."""
+    sorted_classes = [name for name, _id in sorted(class_mapping.items(), key=lambda x: x[1])]
+    
+    yaml_content = f"""# YOLO Dataset Configuration
+path: {Path(output_path).absolute()}
+train: images/train
+val: images/val
+test: images/test
+
+# Classes
+nc: {len(sorted_classes)}
+names: {sorted_classes}
+"""
+    
+    yaml_file = Path(output_path) / 'dataset.yaml'
+    with open(yaml_file, 'w') as f:
+        f.write(yaml_content)
+    return yaml_file
+
 
 def create_yolo_structure(
     images_dir='data/images',
@@ -9,7 +165,10 @@ def create_yolo_structure(
     val_csv='data/val_annotations.csv',
     test_csv='data/test_annotations.csv',
     output_dir='data/yolo_dataset',
-    class_mapping=None
+    class_mapping=None,
+    link_mode='copy',
+    write_workers=0,
+    incremental=True
 ):
     """
     Reorganize data from CSV format to YOLO folder structure.
@@ -30,6 +189,12 @@ def create_yolo_structure(
         train_csv, val_csv, test_csv: Paths to split CSV files
         output_dir: Output directory for YOLO structure
         class_mapping: Dict mapping class names to class IDs (optional)
+        link_mode: How images are placed in the YOLO folders, one of
+            'copy', 'hardlink', 'symlink', 'reflink' or 'auto' (see file_ops.materialize_file)
+        write_workers: Threads used to write label files (0 = write in this thread)
+        incremental: Keep images and label files that are already up to date, so with
+            stable splits (train_test.split_dataset_incremental) a rerun only places
+            new images. Images no longer in a split are removed either way.
     """
     
     output_path = Path(output_dir)
@@ -50,101 +215,203 @@ def create_yolo_structure(
     # Auto-generate class mapping if not provided
 
     if class_mapping is None:
-        all_classes = set()
-        for csv_file in splits.values():
-            df = pd.read_csv(csv_file)
-            all_classes.update(df['class'].unique())
-        class_mapping = {cls: idx for idx, cls in enumerate(sorted(all_classes))}
+        class_mapping = auto_class_mapping(splits.values())
         print(f"Auto-generated class mapping: {class_mapping}")
     
     stats = defaultdict(lambda: {'images': 0, 'annotations': 0})
     
+    image_index, duplicates = build_image_index(images_path)
+    print(f"Indexed {len(image_index)} images in {images_path}")
+    for stem, paths in duplicates.items():
+        print(f"  Warning: duplicate image name {stem}, using {paths[0]} (also {', '.join(str(p) for p in paths[1:])})")
+    missing = defaultdict(list)
+    modes_used = Counter()
+    
     for split_name, csv_file in splits.items():
         print(f"\nProcessing {split_name} split...")
         df = pd.read_csv(csv_file)
         
-        # Group annotations by filename
-        grouped = df.groupby('filename')
-        
-        for filename, group in grouped:
-            # Find source image in category folders
-            source_image = None
-            for category_folder in images_path.iterdir():
-                if not category_folder.is_dir():
-                    continue
-                
-                # Try different extensions
-                for ext in ['.jpg', '.png', '.jpeg', '.JPG', '.PNG', '.JPEG']:
-                    potential_path = category_folder / f"{filename}{ext}"
-                    if potential_path.exists():
-                        source_image = potential_path
-                        break
-                if source_image:
-                    break
-            
+        # Place each image once, then write the labels of every image that was found
+        found = []
+        placed = set()
+        for filename in df['filename'].unique():
+            source_image = image_index.get(filename)
             if source_image is None:
-                print(f"  Warning: Could not find image for {filename}")
+                missing[split_name].append(filename)
                 continue
             
-            # Copy image to YOLO structure
+            # Link or copy image into the YOLO structure
             dest_image = output_path / 'images' / split_name / source_image.name
-            shutil.copy2(source_image, dest_image)
-            
-            # Create YOLO format label file
-            label_file = output_path / 'labels' / split_name / f"{filename}.txt"
-            
-            with open(label_file, 'w') as f:
-                for _, row in group.iterrows():
-                    # Get class ID
-                    class_id = class_mapping[row['class']]
-                    
-                    # Convert bounding box to YOLO format (normalized center coords)
-                    width = row['width']
-                    height = row['height']
-                    
-                    x_center = ((row['xmin'] + row['xmax']) / 2) / width
-                    y_center = ((row['ymin'] + row['ymax']) / 2) / height
-                    bbox_width = (row['xmax'] - row['xmin']) / width
-                    bbox_height = (row['ymax'] - row['ymin']) / height
-                    
-                    # Write YOLO format: class_id x_center y_center width height
-                    f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
-                    
-                    stats[split_name]['annotations'] += 1
-            
-            stats[split_name]['images'] += 1
+            found.append(filename)
+            placed.add(dest_image.name)
+            if incremental and is_materialized(source_image, dest_image):
+                modes_used['unchanged'] += 1
+                count("format.images_unchanged")
+                continue
+            with timer("format.copy_image"):
+                mode_used = materialize_file(source_image, dest_image, link_mode)
+            modes_used[mode_used] += 1
+            count(f"format.images_{mode_used}")
+        
+        split_df = df[df['filename'].isin(found)]
+        counts = write_yolo_labels(split_df, class_mapping, output_path / 'labels' / split_name, write_workers,
+                                   only_changed=incremental)
+        stats[split_name]['images'] += len(counts)
+        stats[split_name]['annotations'] += sum(counts.values())
+        
+        # Drop images (and their labels) that left this split or the dataset
+        stale = [p for p in (output_path / 'images' / split_name).iterdir() if p.name not in placed]
+        for image_file in stale:
+            image_file.unlink()
+            (output_path / 'labels' / split_name / f"{image_file.stem}.txt").unlink(missing_ok=True)
         
         print(f"   Processed {stats[split_name]['images']} images with {stats[split_name]['annotations']} annotations")
+        if stale:
+            print(f"   Removed {len(stale)} images no longer in the {split_name} split")
+        if missing[split_name]:
+            print(f"   Warning: {len(missing[split_name])} images not found: {', '.join(missing[split_name])}")
     
     # Create dataset.yaml file
-    sorted_classes = [name for name, _id in sorted(class_map.items(), key=lambda x: x[1])]
-
-    yaml_content = f"""# YOLO Dataset Configuration
-                        path: {output_path.absolute()}
-                        train: images/train
-                        val: images/val
-                        test: images/test
-
-                        # Classes
-                        nc: {len(sorted_classes)}
-                        names: {sorted_classes}
-                        """
-    
-    yaml_file = output_path / 'dataset.yaml'
-    with open(yaml_file, 'w') as f:
-        f.write(yaml_content)
+    yaml_file = write_dataset_yaml(output_path, class_mapping)
     
     print(f"\n✓ Created dataset.yaml at {yaml_file}")
     print("\n=== Summary ===")
     for split_name, split_stats in stats.items():
         print(f"{split_name.upper()}: {split_stats['images']} images, {split_stats['annotations']} annotations")
     
+    print(f"Images placed by: {dict(modes_used)}")
+    
     print(f"\n=== Class Mapping ===")
     for class_name, class_id in class_mapping.items():
         print(f"  {class_id}: {class_name}")
     
     return output_path
 
+def tile_annotations(corners, class_ids, window, min_visibility=0.5):
+    """
+    Clip an image's boxes to one tile and return them as normalized YOLO rows.
+    
+    Args:
+        corners: float array (n, 4) of xmin, ymin, xmax, ymax in image pixels
+        class_ids: int array (n,)
+        window: (x0, y0, x1, y1) tile window in image pixels
+        min_visibility: Keep a box only if at least this fraction of its area is inside the tile
+    
+    Returns:
+        float64 array (k, 5): class_id, x_center, y_center, width, height relative to the tile
+    """
+    x0, y0, x1, y1 = window
+    clipped = np.empty_like(corners)
+    clipped[:, [0, 2]] = np.clip(corners[:, [0, 2]], x0, x1)
+    clipped[:, [1, 3]] = np.clip(corners[:, [1, 3]], y0, y1)
+    
+    area = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    visible = (clipped[:, 2] - clipped[:, 0]) * (clipped[:, 3] - clipped[:, 1])
+    keep = (visible > 0) & (visible >= min_visibility * np.maximum(area, 1e-9))
+    
+    boxes = clipped[keep] - np.array([x0, y0, x0, y0], dtype=np.float64)
+    tile_w, tile_h = x1 - x0, y1 - y0
+    rows = np.empty((len(boxes), 5), dtype=np.float64)
+    rows[:, 0] = class_ids[keep]
+    rows[:, 1] = ((boxes[:, 0] + boxes[:, 2]) / 2) / tile_w
+    rows[:, 2] = ((boxes[:, 1] + boxes[:, 3]) / 2) / tile_h
+    rows[:, 3] = (boxes[:, 2] - boxes[:, 0]) / tile_w
+    rows[:, 4] = (boxes[:, 3] - boxes[:, 1]) / tile_h
+    return rows
+
+
+def create_tiled_yolo_structure(
+    images_dir='data/images',
+    train_csv='data/train_annotations.csv',
+    val_csv='data/val_annotations.csv',
+    test_csv='data/test_annotations.csv',
+    output_dir='data/yolo_dataset_tiled',
+    class_mapping=None,
+    tile_size=640,
+    overlap=0.2,
+    min_visibility=0.5,
+    empty_ratio=0.1,
+    seed=0
+):
+    """
+    Build a YOLO folder structure of overlapping full-resolution tiles.
+    
+    Images are read, cut and written one at a time, so memory use does not grow
+    with the dataset. Boxes are clipped to each tile and re-normalized; boxes
+    mostly outside a tile are dropped from it.
+    
+    Args:
+        images_dir: Path to Images directory with category subfolders
+        train_csv, val_csv, test_csv: Paths to split CSV files
+        output_dir: Output directory for the tiled YOLO structure
+        class_mapping: Dict mapping class names to class IDs (optional)
+        tile_size: Tile side in pixels
+        overlap: Tile overlap, fraction of tile_size (< 1) or pixels (>= 1)
+        min_visibility: Minimum fraction of a box's area inside a tile to label it there
+        empty_ratio: Fraction of tiles without any box that are kept (0 drops all, 1 keeps all)
+        seed: Seed for the empty-tile subsampling
+    """
+    output_path = Path(output_dir)
+    splits = {'train': train_csv, 'val': val_csv, 'test': test_csv}
+    for split in splits:
+        (output_path / 'images' / split).mkdir(parents=True, exist_ok=True)
+        (output_path / 'labels' / split).mkdir(parents=True, exist_ok=True)
+    
+    if class_mapping is None:
+        class_mapping = auto_class_mapping(splits.values())
+        print(f"Auto-generated class mapping: {class_mapping}")
+    
+    image_index, _ = build_image_index(images_dir)
+    rng = np.random.default_rng(seed)
+    stats = defaultdict(lambda: {'images': 0, 'tiles': 0, 'empty_tiles': 0, 'annotations': 0})
+    
+    for split_name, csv_file in splits.items():
+        print(f"\nTiling {split_name} split...")
+        df = pd.read_csv(csv_file)
+        df = df[df['class'].isin(class_mapping.keys())]
+        
+        for filename, group in df.groupby('filename', sort=False):
+            source_image = image_index.get(filename)
+            if source_image is None:
+                print(f"  Warning: Could not find image for {filename}")
+                continue
+            with timer("format.tile_decode"):
+                image = cv2.imread(str(source_image))
+            if image is None:
+                print(f"  Warning: Could not read {source_image}")
+                continue
+            
+            corners = group[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy(dtype=np.float64)
+            class_ids = group['class'].map(class_mapping).to_numpy(dtype=np.int64)
+            h, w = image.shape[:2]
+            
+            for window in tile_windows(h, w, tile_size, overlap):
+                rows = tile_annotations(corners, class_ids, window, min_visibility)
+                if len(rows) == 0:
+                    if rng.random() >= empty_ratio:
+                        continue
+                    stats[split_name]['empty_tiles'] += 1
+                
+                x0, y0, x1, y1 = (int(v) for v in window)
+                tile_name = f"{filename}_x{x0}_y{y0}"
+                with timer("format.tile_write"):
+                    cv2.imwrite(str(output_path / 'images' / split_name / f"{tile_name}{source_image.suffix}"),
+                                image[y0:y1, x0:x1])
+                with open(output_path / 'labels' / split_name / f"{tile_name}.txt", 'w') as f:
+                    f.write((YOLO_LINE_FORMAT * len(rows)) % tuple(rows.ravel().tolist()))
+                
+                stats[split_name]['tiles'] += 1
+                stats[split_name]['annotations'] += len(rows)
+            stats[split_name]['images'] += 1
+        
+        split_stats = stats[split_name]
+        print(f"   {split_stats['images']} images -> {split_stats['tiles']} tiles "
+              f"({split_stats['empty_tiles']} empty) with {split_stats['annotations']} annotations")
+    
+    yaml_file = write_dataset_yaml(output_path, class_mapping)
+    print(f"\n✓ Created dataset.yaml at {yaml_file}")
+    return output_path
+
 if __name__ == "__main__":
 
     class_map = {
@@ -155,4 +422,13 @@ if __name__ == "__main__":
         }
 
     
-    output_dir = create_yolo_structure(class_mapping=class_map)
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'copy'
+    if mode == 'tiled':
+        tile_size = int(sys.argv[2]) if len(sys.argv) > 2 else 640
+        output_dir = create_tiled_yolo_structure(class_mapping=class_map, tile_size=tile_size)
+    elif mode in LINK_MODES:
+        output_dir = create_yolo_structure(class_mapping=class_map, link_mode=mode)
+    else:
+        print(f"Usage: python format_yolo_folders.py [{'|'.join(LINK_MODES)}]")
+        print("       python format_yolo_folders.py tiled [tile_size]")
+        sys.exit(1)
@@ -0,0 +1,299 @@
+import os
+import json
+import fcntl
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+CACHE_VERSION = 1
+INDEX_NAME = "index.json"
+LOCK_NAME = ".lock"
+DEFAULT_SHARD_BYTES = 256 * 1024 ** 2
+
+# ==============================
+# === Decoded Image Cache ======
+# ==============================
+
+def load_resized(image_path, imgsz, interpolation=cv2.INTER_LINEAR):
+    """
+    Decode an image and resize its long side to imgsz, like Ultralytics' load_image(rect_mode=True).
+
+    Ultralytics resizes with INTER_LINEAR for train and val datasets alike; pass that to
+    get frames identical to uncached loading.
+
+    Returns:
+        (image, (h0, w0)) or None when the file can't be decoded
+    """
+    im = cv2.imread(image_path)
+    if im is None:
+        return None
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=interpolation if r < 1 else cv2.INTER_LINEAR)
+    return im, (h0, w0)
+
+
+def source_signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cache_key(*parts):
+    """Short stable directory name for a dataset/imgsz/variant combination."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class ImageCache:
+    """
+    Pre-decoded, resized frames stored as memory-mapped NumPy shards.
+
+    Each shard is a flat uint8 .npy file holding many frames back to back; index.json
+    maps every source image to (shard, offset, shape) together with the source's
+    mtime/size, so changed or new images are re-decoded on the next update() while
+    everything else is reused. Shards are opened with mmap, so DataLoader workers
+    share the page cache instead of each holding a copy; the first `ram_bytes` worth
+    of shards can be loaded into RAM instead.
+
+    Args:
+        cache_dir: Directory for this dataset + imgsz + variant (see cache_key)
+        imgsz: Long-side size frames are resized to
+        interpolation: OpenCV interpolation used when shrinking frames
+        variant: Tag for what the frames hold ("raw", or e.g. the preprocessing applied)
+        ram_bytes: Shard bytes to keep resident in RAM (0 = mmap only)
+        max_bytes: Disk budget for live frames; images beyond it are not cached
+        shard_bytes: Target size of one shard file
+    """
+
+    def __init__(self, cache_dir, imgsz, interpolation=cv2.INTER_LINEAR, variant="raw", ram_bytes=0, max_bytes=None,
+                 shard_bytes=DEFAULT_SHARD_BYTES):
+        self.cache_dir = cache_dir
+        self.imgsz = imgsz
+        self.interpolation = interpolation
+        self.variant = variant
+        self.ram_bytes = ram_bytes
+        self.max_bytes = max_bytes
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self.entries = {}
+        self._arrays = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    # --- index ---
+
+    def _load_index(self):
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        settings = (index.get("version"), index.get("imgsz"), index.get("interpolation"), index.get("variant"))
+        if settings != (CACHE_VERSION, self.imgsz, self.interpolation, self.variant):
+            return  # written with other settings; rebuilt from scratch by update()
+        shards = index.get("shards", [])
+        if all(os.path.exists(os.path.join(self.cache_dir, s)) for s in shards):
+            self.shards, self.entries = shards, index.get("entries", {})
+
+    def _save_index(self):
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "imgsz": self.imgsz, "interpolation": self.interpolation,
+                       "variant": self.variant, "shards": self.shards, "entries": self.entries}, f)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def _frame_bytes(entry):
+        h, w, c = entry["shape"]
+        return h * w * c
+
+    def live_bytes(self):
+        return sum(self._frame_bytes(e) for e in self.entries.values())
+
+    def shard_file_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.cache_dir, s)) for s in self.shards)
+
+    # --- building ---
+
+    def update(self, image_files, transform=None, workers=8):
+        """
+        Decode every image that is missing from the cache or changed since it was cached.
+
+        Holds an exclusive lock on cache_dir for the whole update, so several processes
+        (e.g. DDP ranks or parallel sweep trials) sharing a cache build it once; the index
+        is re-read after the lock is taken to pick up what another process wrote.
+
+        Args:
+            image_files: Source image paths
+            transform: Optional function applied to each resized frame before caching
+            workers: Decode threads (OpenCV releases the GIL)
+
+        Returns:
+            Number of frames written
+        """
+        self.close()
+        with open(os.path.join(self.cache_dir, LOCK_NAME), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.shards, self.entries = [], {}
+                self._load_index()
+                return self._update(image_files, transform, workers)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _update(self, image_files, transform, workers):
+        wanted = {os.path.abspath(f): f for f in image_files}
+        stale = [p for p in self.entries if p not in wanted]
+        for path in stale:
+            del self.entries[path]
+
+        todo = []
+        for path in wanted:
+            entry = self.entries.get(path)
+            try:
+                signature = source_signature(path)
+            except FileNotFoundError:
+                self.entries.pop(path, None)
+                continue
+            if entry is None or entry["source"] != signature:
+                self.entries.pop(path, None)
+                todo.append(path)
+
+        # Rewrite the shards when most of their bytes belong to dropped/replaced frames
+        if self.shards and self.shard_file_bytes() > 2 * self.live_bytes() + self.shard_bytes:
+            self._compact()
+
+        written = self._write_frames(todo, transform, workers) if todo else 0
+        self._remove_unreferenced_shards()
+        self._save_index()
+        if written or stale:
+            print(f"Image cache {self.cache_dir}: {written} frames written, {len(self.entries)} cached, "
+                  f"{self.live_bytes() / 1024 ** 2:.0f} MiB")
+        return written
+
+    def _next_shard_name(self):
+        numbers = [int(s.split("_")[1].split(".")[0]) for s in self.shards]
+        return f"shard_{max(numbers, default=-1) + 1:05d}.npy"
+
+    def _flush(self, frames):
+        """frames: list of (path, signature, frame, hw0) -> one new shard file."""
+        if not frames:
+            return
+        name = self._next_shard_name()
+        offset = 0
+        for path, signature, frame, hw0 in frames:
+            self.entries[path] = {"source": signature, "shard": name, "offset": offset,
+                                  "shape": list(frame.shape), "hw0": list(hw0)}
+            offset += frame.nbytes
+        tmp_path = os.path.join(self.cache_dir, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.concatenate([frame.reshape(-1) for _, _, frame, _ in frames]))
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        self.shards.append(name)
+
+    def _write_frames(self, paths, transform, workers):
+        budget = self.max_bytes - self.live_bytes() if self.max_bytes is not None else None
+
+        def decode(path):
+            try:
+                signature = source_signature(path)
+                loaded = load_resized(path, self.imgsz, self.interpolation)
+            except OSError:
+                return path, None, None, None
+            if loaded is None:
+                return path, None, None, None
+            frame, hw0 = loaded
+            if transform is not None:
+                frame = transform(frame)
+            return path, signature, np.ascontiguousarray(frame, dtype=np.uint8), hw0
+
+        written, pending, pending_bytes, skipped = 0, [], 0, 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for path, signature, frame, hw0 in pool.map(decode, paths):
+                if frame is None:
+                    continue
+                if budget is not None and frame.nbytes > budget:
+                    skipped += 1
+                    continue
+                if budget is not None:
+                    budget -= frame.nbytes
+                pending.append((path, signature, frame, hw0))
+                pending_bytes += frame.nbytes
+                written += 1
+                if pending_bytes >= self.shard_bytes:
+                    self._flush(pending)
+                    pending, pending_bytes = [], 0
+        self._flush(pending)
+        if skipped:
+            print(f"Image cache budget reached: {skipped} frames left uncached")
+        return written
+
+    def _compact(self):
+        """Copy live frames into fresh shards, one shard in memory at a time."""
+        old_shards = {s: np.load(os.path.join(self.cache_dir, s), mmap_mode="r") for s in self.shards}
+        live, self.entries = list(self.entries.items()), {}
+
+        pending, pending_bytes = [], 0
+        for path, entry in live:
+            start = entry["offset"]
+            data = old_shards[entry["shard"]][start:start + self._frame_bytes(entry)]
+            pending.append((path, entry["source"], np.array(data).reshape(entry["shape"]), entry["hw0"]))
+            pending_bytes += data.nbytes
+            if pending_bytes >= self.shard_bytes:
+                self._flush(pending)
+                pending, pending_bytes = [], 0
+        self._flush(pending)
+        del old_shards
+
+    def _remove_unreferenced_shards(self):
+        used = {e["shard"] for e in self.entries.values()}
+        for name in [s for s in self.shards if s not in used]:
+            os.remove(os.path.join(self.cache_dir, name))
+            self.shards.remove(name)
+
+    # --- reading ---
+
+    def _open(self):
+        self._arrays = {}
+        resident = 0
+        for name in self.shards:
+            path = os.path.join(self.cache_dir, name)
+            size = os.path.getsize(path)
+            if resident + size <= self.ram_bytes:
+                self._arrays[name] = np.load(path)
+                resident += size
+            else:
+                self._arrays[name] = np.load(path, mmap_mode="r")
+
+    def close(self):
+        self._arrays = None
+
+    def get(self, image_path):
+        """
+        Cached frame for image_path as (image, (h0, w0), (h, w)), or None on a miss.
+
+        Sources are only checked for changes in update(), not on every read.
+        The image is a private writable copy, so in-place augmentation can't touch the cache.
+        """
+        entry = self.entries.get(os.path.abspath(image_path))
+        if entry is None:
+            return None
+        if self._arrays is None:
+            self._open()
+        start = entry["offset"]
+        im = np.array(self._arrays[entry["shard"]][start:start + self._frame_bytes(entry)]).reshape(entry["shape"])
+        return im, tuple(entry["hw0"]), im.shape[:2]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # Memmaps would be pickled as full copies; workers reopen the shards instead
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import glob
+import time
+import atexit
+import bisect
+import threading
+import functools
+import multiprocessing
+import multiprocessing.util
+
+ENV_VAR = "PCB_METRICS"              # directory to write metrics to; unset = disabled
+SESSION_ENV_VAR = "PCB_METRICS_SESSION"
+
+# Histogram bucket upper bounds in seconds (Prometheus "le"), roughly 2.5x apart
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 300.0)
+
+# ==========================
+# === Metric Registry ======
+# ==========================
+
+_enabled = bool(os.environ.get(ENV_VAR))
+_lock = threading.Lock()
+_timers = {}     # name -> {"buckets": counts per BUCKETS bound + overflow, "count", "sum", "min", "max"}
+_counters = {}   # name -> float
+
+
+def enabled():
+    return _enabled
+
+
+def _observe(name, seconds):
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            entry = _timers[name] = {"buckets": [0] * (len(BUCKETS) + 1), "count": 0, "sum": 0.0,
+                                     "min": seconds, "max": seconds}
+        entry["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["min"] = min(entry["min"], seconds)
+        entry["max"] = max(entry["max"], seconds)
+
+
+def observe(name, seconds):
+    """Record one duration (seconds) for `name`."""
+    if _enabled:
+        _observe(name, seconds)
+
+
+def count(name, n=1):
+    """Add n to the counter `name`."""
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """
+    Context manager timing its block into the histogram `name`.
+
+    When instrumentation is off this returns a shared no-op object, so the cost is
+    one function call and a global lookup.
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name=None):
+    """Decorator version of timer(); the name defaults to module.function."""
+    def decorate(func):
+        metric = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _observe(metric, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+# ==========================
+# === Snapshots & Export ===
+# ==========================
+
+def snapshot():
+    """Copy of everything recorded so far in this process."""
+    with _lock:
+        return {
+            "buckets": list(BUCKETS),
+            "timers": {k: dict(v, buckets=list(v["buckets"])) for k, v in _timers.items()},
+            "counters": dict(_counters),
+        }
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def merge(snapshots):
+    """Combine snapshots (e.g. from worker processes) into one."""
+    merged = {"buckets": list(BUCKETS), "timers": {}, "counters": {}}
+    for snap in snapshots:
+        for name, t in snap.get("timers", {}).items():
+            m = merged["timers"].get(name)
+            if m is None:
+                merged["timers"][name] = dict(t, buckets=list(t["buckets"]))
+                continue
+            m["buckets"] = [a + b for a, b in zip(m["buckets"], t["buckets"])]
+            m["count"] += t["count"]
+            m["sum"] += t["sum"]
+            m["min"] = min(m["min"], t["min"])
+            m["max"] = max(m["max"], t["max"])
+        for name, value in snap.get("counters", {}).items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+    return merged
+
+
+def _prom_escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(snap, prefix="pcb"):
+    """Prometheus text exposition of a snapshot (one histogram family, one counter family)."""
+    lines = [f"# HELP {prefix}_stage_duration_seconds Time spent per pipeline stage",
+             f"# TYPE {prefix}_stage_duration_seconds histogram"]
+    for name in sorted(snap["timers"]):
+        t = snap["timers"][name]
+        label = f'stage="{_prom_escape(name)}"'
+        cumulative = 0
+        for bound, n in zip(snap["buckets"], t["buckets"]):
+            cumulative += n
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="+Inf"}} {t["count"]}')
+        lines.append(f"{prefix}_stage_duration_seconds_sum{{{label}}} {t['sum']:.9f}")
+        lines.append(f"{prefix}_stage_duration_seconds_count{{{label}}} {t['count']}")
+    lines += [f"# HELP {prefix}_events_total Pipeline event counters",
+              f"# TYPE {prefix}_events_total counter"]
+    for name in sorted(snap["counters"]):
+        lines.append(f'{prefix}_events_total{{event="{_prom_escape(name)}"}} {snap["counters"][name]}')
+    return "\n".join(lines) + "\n"
+
+
+def report(snap, top=30):
+    """Print the stages with the most total time."""
+    rows = sorted(snap["timers"].items(), key=lambda kv: kv[1]["sum"], reverse=True)[:top]
+    print(f"{'stage':<40s} {'count':>9s} {'total s':>10s} {'mean ms':>10s} {'max ms':>10s}")
+    for name, t in rows:
+        print(f"{name:<40s} {t['count']:>9d} {t['sum']:>10.3f} {t['sum'] / t['count'] * 1000:>10.3f} "
+              f"{t['max'] * 1000:>10.3f}")
+    for name, value in sorted(snap["counters"].items()):
+        print(f"{name:<40s} {value:>9g}")
+
+
+def write_snapshot(snap, json_path, prom_path=None):
+    os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snap, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, json_path)
+    if prom_path:
+        with open(prom_path, "w") as f:
+            f.write(to_prometheus(snap))
+
+
+# ==================================
+# === Process Lifecycle Plumbing ===
+# ==================================
+#
+# Every process of a session (the main process and its multiprocessing children:
+# ProcessPoolExecutor workers, DataLoader workers) writes process_<session>_<pid>.json
+# into the metrics directory when it exits; the main process then merges them into
+# metrics.json and metrics.prom.
+
+def _output_dir():
+    return os.environ.get(ENV_VAR)
+
+
+def _session():
+    return os.environ.get(SESSION_ENV_VAR, str(os.getpid()))
+
+
+def _dump_process():
+    out_dir = _output_dir()
+    snap = snapshot()
+    if out_dir and (snap["timers"] or snap["counters"]):
+        write_snapshot(snap, os.path.join(out_dir, f"process_{_session()}_{os.getpid()}.json"))
+
+
+def _dump_session():
+    out_dir = _output_dir()
+    if not out_dir:
+        return
+    pattern = os.path.join(out_dir, f"process_{_session()}_*.json")
+    snaps = [snapshot()]
+    for path in glob.glob(pattern):
+        with open(path, "r") as f:
+            snaps.append(json.load(f))
+        os.remove(path)
+    write_snapshot(merge(snaps), os.path.join(out_dir, "metrics.json"), os.path.join(out_dir, "metrics.prom"))
+
+
+def _register_exit_hook():
+    if os.environ.get(SESSION_ENV_VAR) in (None, str(os.getpid())):
+        atexit.register(_dump_session)
+    else:
+        # A separate program started by an instrumented parent (e.g. sweep.py -> train.py);
+        # multiprocessing children never get here through atexit, see _child_started
+        atexit.register(_dump_process)
+
+
+class _HookOwner:
+    pass
+
+
+_hook_owner = _HookOwner()
+
+
+def _child_started(_owner):
+    # Runs in every multiprocessing child (fork and spawn) once it is set up. Such children
+    # leave through os._exit, which skips atexit but not multiprocessing finalizers.
+    reset()  # a forked child starts with a copy of the parent's numbers
+    if _enabled:
+        multiprocessing.util.Finalize(None, _dump_process, exitpriority=10)
+
+
+def enable(output_dir):
+    """
+    Turn instrumentation on for this process and every process it starts afterwards.
+
+    Equivalent to running with PCB_METRICS=<output_dir> in the environment.
+    """
+    global _enabled
+    os.environ[ENV_VAR] = output_dir
+    os.environ.setdefault(SESSION_ENV_VAR, str(os.getpid()))
+    if not _enabled:
+        _enabled = True
+        _register_exit_hook()
+
+
+multiprocessing.util.register_after_fork(_hook_owner, _child_started)
+if _enabled:
+    os.environ.setdefault(SESSION_ENV_VAR, str(os.getpid()))
+    _register_exit_hook()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python instrumentation.py <metrics dir | metrics.json> [--prom]")
+        print("Record metrics by running any pipeline script with PCB_METRICS=<dir> set.")
+        sys.exit(1)
+
+    target = sys.argv[1]
+    json_path = os.path.join(target, "metrics.json") if os.path.isdir(target) else target
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    if "--prom" in sys.argv[2:]:
+        print(to_prometheus(data), end="")
+    else:
+        report(data)
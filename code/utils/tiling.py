@@ -0,0 +1,41 @@
+# Tile grid helpers shared by tiled inference and the tiled dataset builder
+
+# Libraries
+import numpy as np
+
+
+def tile_origins(length, tile_size, overlap):
+    """
+    Start offsets of tiles covering [0, length) with at least `overlap` pixels shared.
+    
+    The last tile is aligned to the end so every tile is full size
+    (a single tile covers the whole length when length <= tile_size).
+    """
+    if length <= tile_size:
+        return [0]
+    step = max(1, tile_size - overlap)
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def tile_windows(img_height, img_width, tile_size=640, overlap=0.2):
+    """
+    Overlapping tile windows covering an image.
+    
+    Args:
+        img_height, img_width: Image size in pixels
+        tile_size: Tile side in pixels
+        overlap: Overlap between neighbouring tiles, as a fraction of tile_size (< 1)
+            or in pixels (>= 1)
+    
+    Returns:
+        int array of shape (n_tiles, 4): x0, y0, x1, y1
+    """
+    overlap_px = int(overlap * tile_size) if overlap < 1 else int(overlap)
+    windows = [
+        (x0, y0, min(x0 + tile_size, img_width), min(y0 + tile_size, img_height))
+        for y0 in tile_origins(img_height, tile_size, overlap_px)
+        for x0 in tile_origins(img_width, tile_size, overlap_px)
+    ]
+    return np.array(windows, dtype=np.int64).reshape(-1, 4)
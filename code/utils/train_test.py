@@ -1,7 +1,16 @@
 ## Train Test Split
 
+import os
+import sys
+import hashlib
+from collections import Counter, defaultdict
+
 import pandas as pd
-from sklearn.model_selection import GroupShuffleSplit 
+from sklearn.model_selection import GroupShuffleSplit
+
+SPLITS = ("train", "val", "test")
+# Same proportions as split_dataset: 20% test, then 25% of the rest for val
+SPLIT_FRACTIONS = {"test": 0.2, "val": 0.2, "train": 0.6}
 
 
 def split_dataset():
@@ -16,25 +25,165 @@ def split_dataset():
     test_split = test_splitter.split(df, groups=df['filename'])
     train_inds, test_inds = next(test_split)
 
-    # Further split train into train and val
+    # Further split train into train and val (indices are relative to train_val)
+    train_val = df.iloc[train_inds]
     val_splitter = GroupShuffleSplit(test_size=0.25, n_splits=2, random_state = 7)
-    val_split = (val_splitter.split(df.iloc[train_inds], groups=df.iloc[train_inds]['filename']))
+    val_split = (val_splitter.split(train_val, groups=train_val['filename']))
     train_inds,val_inds = next(val_split)
 
     # Create the final datasets
-    train = df.iloc[train_inds]
+    train = train_val.iloc[train_inds]
     test = df.iloc[test_inds]
-    val = df.iloc[val_inds]
+    val = train_val.iloc[val_inds]
 
     # Save to csv
     train.to_csv('data/train_annotations.csv', index=False)
-    test.to_csv('data/test_annotations.csv', index=False)  
+    test.to_csv('data/test_annotations.csv', index=False)
     val.to_csv('data/val_annotations.csv', index=False)
 
     print(f"Train set: {len(train)} annotations")
     print(f"Validation set: {len(val)} annotations")
     print(f"Test set: {len(test)} annotations")
 
+
+# ======================================
+# === Deterministic Hash-based Split ===
+# ======================================
+
+def filename_hash(filename, salt=""):
+    """Stable position of a filename in [0, 1), the same on every machine and run."""
+    digest = hashlib.sha1(f"{salt}{filename}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def hash_split(filename, salt="", fractions=SPLIT_FRACTIONS):
+    """Split a filename falls in when [0, 1) is cut into test, val and train intervals."""
+    u = filename_hash(filename, salt)
+    edge = 0.0
+    for split in ("test", "val", "train"):
+        edge += fractions[split]
+        if u < edge:
+            return split
+    return "train"
+
+
+def dominant_classes(df):
+    """Most frequent class per filename (ties go to the first class name in sorted order)."""
+    counts = df.groupby(["filename", "class"]).size().reset_index(name="n")
+    counts = counts.sort_values(["filename", "n", "class"], ascending=[True, False, True])
+    return counts.drop_duplicates("filename").set_index("filename")["class"].to_dict()
+
+
+def load_assignments(data_dir="data"):
+    """
+    filename -> split from the split CSVs already in data_dir.
+
+    A filename found in more than one CSV (older random splits could overlap) is kept
+    in test, then val, so evaluation images never drift into train.
+    """
+    assignments = {}
+    for split in ("train", "val", "test"):
+        csv_file = os.path.join(data_dir, f"{split}_annotations.csv")
+        if os.path.exists(csv_file):
+            for filename in pd.read_csv(csv_file, usecols=["filename"])["filename"].astype(str).unique():
+                assignments[filename] = split
+    return assignments
+
+
+def assign_splits(filenames, existing=None, salt="", stratify_by=None, fractions=SPLIT_FRACTIONS):
+    """
+    Assign filenames to splits, keeping every filename that already has one where it is.
+
+    New filenames go to the split their hash falls in. With stratify_by (filename ->
+    class), new filenames are instead taken in hash order and each goes to the split
+    furthest below its share of that class, counting the images already assigned;
+    ties are broken by the filename's hash.
+
+    Returns:
+        Dict filename -> split
+    """
+    existing = existing or {}
+    assignments = {f: existing[f] for f in filenames if f in existing}
+    new = sorted((f for f in filenames if f not in assignments), key=lambda f: filename_hash(f, salt))
+    if stratify_by is None:
+        assignments.update((f, hash_split(f, salt, fractions)) for f in new)
+        return assignments
+
+    totals = Counter(stratify_by[f] for f in filenames)
+    counts = defaultdict(Counter)
+    for f, split in assignments.items():
+        counts[stratify_by[f]][split] += 1
+    for f in new:
+        cls = stratify_by[f]
+        deficits = {split: share * totals[cls] - counts[cls][split] for split, share in fractions.items()}
+        best = max(deficits.values())
+        tied = [split for split, deficit in deficits.items() if deficit >= best - 1e-9]
+        split = tied[int(filename_hash(f, salt + ":tie") * len(tied))]
+        assignments[f] = split
+        counts[cls][split] += 1
+    return assignments
+
+
+def split_dataset_incremental(annotations_csv='data/annotations.csv', data_dir='data', stratify=False, salt="",
+                              reset=False):
+    """
+    Split annotations into train/val/test by filename hash, without moving existing images.
+
+    Images already listed in data_dir's split CSVs keep their split; only new filenames
+    are assigned (see assign_splits) and filenames gone from the annotations are dropped.
+    Rerunning after adding boards therefore only adds images to the splits, and
+    create_yolo_structure / the enhancement manifest only process those.
+
+    Args:
+        annotations_csv: Full annotation CSV
+        data_dir: Where {train,val,test}_annotations.csv are read and written
+        stratify: Balance new images per dominant defect class
+        salt: Changes the hash, i.e. picks another (equally stable) split
+        reset: Ignore the existing split CSVs and assign every filename afresh
+
+    Returns:
+        Dict with the assignments and the delta: "added" (split -> filenames) and "removed"
+    """
+    df = pd.read_csv(annotations_csv)
+    df['filename'] = df['filename'].astype(str)
+    filenames = list(df['filename'].unique())
+
+    existing = {} if reset else load_assignments(data_dir)
+    stratify_by = dominant_classes(df) if stratify else None
+    assignments = assign_splits(filenames, existing, salt, stratify_by)
+
+    added = defaultdict(list)
+    for f in filenames:
+        if f not in existing:
+            added[assignments[f]].append(f)
+    current = set(filenames)
+    removed = sorted(f for f in existing if f not in current)
+
+    split_of_row = df['filename'].map(assignments)
+    for split in SPLITS:
+        split_df = df[split_of_row == split]
+        split_df.to_csv(os.path.join(data_dir, f"{split}_annotations.csv"), index=False)
+        print(f"{split.capitalize()} set: {split_df['filename'].nunique()} images, {len(split_df)} annotations "
+              f"(+{len(added[split])} new)")
+    if removed:
+        print(f"Dropped {len(removed)} images no longer in {annotations_csv}")
+
+    if stratify:
+        per_class = pd.crosstab(pd.Series(stratify_by, name="class"), pd.Series(assignments, name="split"))
+        print(per_class.reindex(columns=list(SPLITS), fill_value=0))
+
+    return {"assignments": assignments, "added": dict(added), "removed": removed}
+
+
 if __name__ == "__main__":
-    split_dataset()
-    
\ No newline at end of file
+    mode = sys.argv[1] if len(sys.argv) > 1 else "shuffle"
+    if mode == "shuffle":
+        split_dataset()
+    elif mode in ("hash", "stratified"):
+        split_dataset_incremental(stratify=mode == "stratified", reset="--reset" in sys.argv[2:])
+    else:
+        print("Usage: python train_test.py [shuffle|hash|stratified] [--reset]")
+        print("  shuffle:    random GroupShuffleSplit of the whole dataset (default)")
+        print("  hash:       stable per-filename split; existing images keep their split")
+        print("  stratified: like hash, balancing new images per dominant defect class")
+        sys.exit(1)